@@ -1,7 +1,13 @@
 import streamlit as st
 from dotenv import load_dotenv
-from helpers import call_eye_pop, update_state_vars
+from extraction import NUTRITIONS, THRESHOLD, get_nutrition_values
+from extraction.metrics import METRICS
+from helpers import call_eye_pop, get_result_store, predict_files, raw_response_browser, update_state_vars
+import json
 import os
+import pandas as pd
+from prediction_cache import image_key
+from resilience import CircuitOpenError, LatencyBudgetExceeded
 
 # for deployment
 try:
@@ -21,6 +27,9 @@ if 'uploaded_file' not in st.session_state:
     st.session_state.nutrition_data = None
     st.session_state.raw_response = None
 
+if 'batch_results' not in st.session_state:
+    st.session_state.batch_results = {}
+
 
 
 
@@ -28,41 +37,123 @@ st.title("Nutrition Label Reader")
 
 format_option = st.selectbox("Select format", ["json", "dataframe (editable)"])
 st.slider("Confidence threshold", 0.0, 1.0, 0.5, key="confidence_threshold")
-uploaded_file = st.file_uploader("Choose a file")
-if uploaded_file is not None:
-    st.session_state.uploaded_file = uploaded_file
-    response = call_eye_pop(uploaded_file)
-    update_state_vars(response)
+mode = st.radio("Mode", ["Single image", "Batch"], horizontal=True)
+
+if mode == "Single image":
+    uploaded_file = st.file_uploader("Choose a file")
+    if uploaded_file is not None:
+        st.session_state.uploaded_file = uploaded_file
+        try:
+            response = call_eye_pop(uploaded_file)
+            update_state_vars(response)
+        except (LatencyBudgetExceeded, CircuitOpenError) as e:
+            # the previous result stays on screen
+            st.error(f"EyePop did not answer in time, try again later ({e})")
     
-col1, col2 = st.columns(2)
-
-with col1:
-    if st.session_state.uploaded_file is not None or st.session_state.nutrition_data is not None:
-        st.write("Original Image")
-        st.image(st.session_state.uploaded_file, caption="Uploaded PNG")
-    else:
-        st.write("Upload an image to get the result")
-        
-with col2:
-    if st.session_state.uploaded_file is not None or st.session_state.nutrition_data is not None:
-        st.write("Result")        
-        # Create containers for both formats
-        json_container = st.empty()
-        dataframe_container = st.empty()
-        
-        # Populate both containers
-        with json_container:
-            st.json(st.session_state.nutrition_data)
-        
-        with dataframe_container:
-            st.data_editor(st.session_state.nutrition_data)
-        
-        # Show/hide based on selection
-        if format_option == "json":
-            dataframe_container.empty()
+    col1, col2 = st.columns(2)
+
+    with col1:
+        if st.session_state.uploaded_file is not None or st.session_state.nutrition_data is not None:
+            st.write("Original Image")
+            st.image(st.session_state.uploaded_file, caption="Uploaded PNG")
         else:
-            json_container.empty()
+            st.write("Upload an image to get the result")
+        
+    with col2:
+        if st.session_state.uploaded_file is not None or st.session_state.nutrition_data is not None:
+            st.write("Result")        
+            # Only build the selected format, the other one would be sent to the browser for nothing
+            if format_option == "json":
+                st.json(st.session_state.nutrition_data)
+                nutrition = st.session_state.nutrition_data
+            else:
+                # the corrections made in the dataframe are what gets saved
+                nutrition = st.data_editor(st.session_state.nutrition_data)
+
+            if st.button("Save result"):
+                get_result_store().add(
+                    nutrition, st.session_state.uploaded_file.name, image_key(st.session_state.uploaded_file.getvalue())
+                )
+                st.toast("Result saved")
             
-if st.session_state.uploaded_file is not None or st.session_state.raw_response is not None:            
-    st.write("Raw Response")
-    st.json(st.session_state.raw_response, expanded=False)
\ No newline at end of file
+    if st.session_state.raw_response is not None:
+        # nothing of the response is built until it is asked for, then one page at a time
+        if st.toggle("Show detected objects", key="show_raw_response"):
+            raw_response_browser(st.session_state.raw_response)
+
+else:
+    uploaded_files = st.file_uploader("Choose files", accept_multiple_files=True)
+    # results are kept across reruns, moving the slider only parses the stored responses again
+    results = st.session_state.batch_results
+    for file_id in set(results) - {uploaded_file.file_id for uploaded_file in uploaded_files}:
+        del results[file_id]
+
+    def show_result(placeholder, result):
+        with placeholder.container():
+            if result["error"] is not None:
+                st.error(f"{type(result['error']).__name__}: {result['error']}")
+            elif format_option == "json":
+                st.json(result["nutrition"])
+            else:
+                # the corrections made in the dataframe are what the table and the store get
+                result["nutrition"] = st.data_editor(result["nutrition"], key=f"editor_{result['file_id']}")
+
+    def parse(uploaded_file, response, error):
+        nutrition = None
+        if response is not None:
+            nutrition = get_nutrition_values(response, NUTRITIONS, THRESHOLD, st.session_state.confidence_threshold)
+        return {"file_id": uploaded_file.file_id, "name": uploaded_file.name, "response": response, "nutrition": nutrition, "error": error}
+
+    # one card per image, filled in as soon as its prediction lands
+    placeholders = {}
+    grid = st.columns(3)
+    for i, uploaded_file in enumerate(uploaded_files):
+        with grid[i % 3].container(border=True):
+            st.image(uploaded_file, caption=uploaded_file.name)
+            placeholders[uploaded_file.file_id] = st.empty()
+            if uploaded_file.file_id in results:
+                result = results[uploaded_file.file_id]
+                results[uploaded_file.file_id] = parse(uploaded_file, result["response"], result["error"])
+                show_result(placeholders[uploaded_file.file_id], results[uploaded_file.file_id])
+            else:
+                placeholders[uploaded_file.file_id].info("Processing...")
+
+    todo = [uploaded_file for uploaded_file in uploaded_files if uploaded_file.file_id not in results]
+    for uploaded_file, response, error in predict_files(todo):
+        results[uploaded_file.file_id] = parse(uploaded_file, response, error)
+        show_result(placeholders[uploaded_file.file_id], results[uploaded_file.file_id])
+
+    if results:
+        # one row per image in upload order, one column per nutrition
+        rows = []
+        for uploaded_file in uploaded_files:
+            result = results[uploaded_file.file_id]
+            rows.append({"image": result["name"], **(result["nutrition"] or {})})
+            if result["error"] is not None:
+                rows[-1]["error"] = str(result["error"])
+        table = pd.DataFrame(rows)
+        st.write("All Results")
+        st.dataframe(table, hide_index=True)
+        st.download_button("Download CSV", table.to_csv(index=False), "nutrition.csv", "text/csv")
+        if st.button("Save results"):
+            count = get_result_store().add_many(
+                {
+                    "image": uploaded_file.name,
+                    "image_key": image_key(uploaded_file.getvalue()),
+                    "nutrition": results[uploaded_file.file_id]["nutrition"],
+                }
+                for uploaded_file in uploaded_files
+            )
+            st.toast(f"{count} results saved")
+
+with st.expander("Metrics", expanded=False):
+    metrics = METRICS.to_json()
+    st.write(f"Cache hit rate: {metrics['cache_hit_rate']:.0%}")
+    # one row per request, with the seconds spent in each stage
+    st.dataframe([
+        {"request": request["name"], "total": request["total"], **request["stages"],
+         **{key: request[key] for key in ("cache", "response_objects", "error") if key in request}}
+        for request in metrics["requests"]
+    ])
+    st.download_button("Download JSON", json.dumps(metrics, indent=2), "metrics.json", "application/json")
+    st.download_button("Download Prometheus", METRICS.to_prometheus(), "metrics.prom", "text/plain")
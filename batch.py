@@ -0,0 +1,210 @@
+"""
+Extracts the nutrition of every label image in a directory or manifest, with concurrent
+uploads, and streams one {"image", "image_key", "nutrition"} JSON record per line as they finish.
+
+The output file is also the checkpoint: running the same command again skips the images
+that already have a record, so a crash does not redo finished images. Failed images get an
+{"image", "error"} record and are retried on the next run.
+
+Usage:
+    python batch.py images/ -o results.jsonl --concurrency 8 --parse-workers 4
+    python batch.py manifest.txt -o results.jsonl --store
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from extraction import NUTRITIONS, THRESHOLD, get_nutrition_values
+from extraction.metrics import METRICS
+from prediction_cache import image_key
+from preprocess import predict_downscaled, settings_id
+
+# variables
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp", ".bmp", ".gif", ".tif", ".tiff"}
+
+
+def list_images(source):
+    """
+    Lists the images to process, either every image under a directory or the paths in a
+    manifest file (one path per line, or JSON lines with an 'image' key).
+
+    Args:
+        source (str): A directory or a manifest file.
+
+    Returns:
+        list: The image paths, in a stable order.
+    """
+    if os.path.isdir(source):
+        images = []
+        for root, _, files in os.walk(source):
+            images.extend(
+                os.path.join(root, name)
+                for name in files
+                if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+            )
+        return sorted(images)
+
+    images = []
+    base = os.path.dirname(source)
+    with open(source) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            image = json.loads(line)["image"] if line.startswith("{") else line
+            # relative paths in a manifest are relative to the manifest
+            images.append(image if os.path.isabs(image) else os.path.join(base, image))
+    return images
+
+
+def load_checkpoint(output):
+    """
+    Gets the images that already have a successful record in the output file.
+    """
+    finished = set()
+    if not os.path.exists(output):
+        return finished
+    with open(output) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # a line cut short by a crash
+            if "nutrition" in record:
+                finished.add(record["image"])
+    return finished
+
+
+def process_image(filepath, pool, cache, parse_pool, confidence_threshold):
+    """
+    Gets the prediction of one image and parses it in the worker pool.
+
+    Returns:
+        dict: The {"image", "image_key", "nutrition"} record, or {"image", "error"} if it failed.
+    """
+    try:
+        with METRICS.request(filepath):
+            with open(filepath, "rb") as f:
+                image_bytes = f.read()
+
+            def predict():
+                return predict_downscaled(pool.predict_bytes, image_bytes)
+
+            if cache is None:
+                response = predict()
+            else:
+                response = cache.get_or_predict(image_bytes, predict, os.getenv("EYEPOP_POP_ID"), settings_id())
+            with METRICS.timer("parse_worker"):
+                nutrition = parse_pool.submit(
+                    get_nutrition_values, response, NUTRITIONS, THRESHOLD, confidence_threshold
+                ).result()
+        return {"image": filepath, "image_key": image_key(image_bytes), "nutrition": nutrition}
+    except Exception as e:
+        return {"image": filepath, "error": f"{type(e).__name__}: {e}"}
+
+
+def run_batch(
+    images,
+    output,
+    pool,
+    cache=None,
+    store=None,
+    concurrency=4,
+    parse_workers=None,
+    confidence_threshold=0.5,
+    progress=True,
+):
+    """
+    Processes the images with at most `concurrency` uploads in flight, appending a record to
+    `output` as soon as each image is finished. Images already in `output` are skipped.
+
+    Args:
+        images (list): Paths of the images to process.
+        output (str): Path of the JSON lines file to append the records to.
+        pool (EndpointPool): Pool of endpoints to send the images with, or a `ResilientPredictor` around it.
+        cache (PredictionCache): Optional cache of predictions.
+        store (ResultStore): Optional store the successful records are also written to.
+        concurrency (int): Maximum number of images being uploaded at once.
+        parse_workers (int): Number of processes parsing the responses, the number of CPUs by default.
+        confidence_threshold (float): Minimum confidence level for valid objects.
+        progress (bool): Whether to report progress on stderr.
+
+    Returns:
+        dict: The number of images 'done', 'failed' and 'skipped'.
+    """
+    finished = load_checkpoint(output)
+    todo = [image for image in images if image not in finished]
+    counts = {"done": 0, "failed": 0, "skipped": len(images) - len(todo)}
+    start = time.monotonic()
+
+    uploads = ThreadPoolExecutor(max_workers=concurrency)
+    parse_pool = ProcessPoolExecutor(max_workers=parse_workers)
+    with uploads, parse_pool, open(output, "a") as out:
+
+        def write(futures):
+            records = [future.result() for future in futures]
+            for record in records:
+                out.write(json.dumps(record) + "\n")
+                counts["failed" if "error" in record else "done"] += 1
+            out.flush()  # every written record is checkpointed
+            if store is not None:
+                store.add_many(records)  # one transaction for every record finished together
+            if progress:
+                finished_count = counts["done"] + counts["failed"]
+                rate = finished_count / max(time.monotonic() - start, 1e-9)
+                print(
+                    f"\r[{finished_count}/{len(todo)}] {counts['failed']} failed, {rate:.1f} images/s",
+                    end="",
+                    file=sys.stderr,
+                )
+
+        pending = set()
+        for image in todo:
+            if len(pending) >= concurrency * 2:  # do not queue the whole catalogue in memory
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                write(done)
+            pending.add(uploads.submit(process_image, image, pool, cache, parse_pool, confidence_threshold))
+        write(wait(pending).done)
+
+    if progress:
+        print(file=sys.stderr)
+    return counts
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from endpoint_pool import EndpointPool
+    from prediction_cache import PredictionCache
+    from resilience import BUDGET, ResilientPredictor
+    from result_store import ResultStore
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="directory of images or manifest file")
+    parser.add_argument("-o", "--output", required=True, help="JSON lines file to write the records to")
+    parser.add_argument("--concurrency", type=int, default=4, help="maximum number of uploads in flight")
+    parser.add_argument("--parse-workers", type=int, default=None, help="number of parsing processes")
+    parser.add_argument("--confidence", type=float, default=0.5, help="confidence threshold")
+    parser.add_argument("--no-cache", action="store_true", help="always call EyePop")
+    parser.add_argument("--store", action="store_true", help="also save the results to the result store")
+    parser.add_argument("--budget", type=float, default=BUDGET, help="seconds an image may take, retries included")
+    parser.add_argument("--no-hedge", action="store_true", help="never send duplicate requests for slow images")
+    args = parser.parse_args()
+    load_dotenv()
+
+    pool = EndpointPool(size=args.concurrency)
+    predictor = ResilientPredictor(pool, budget=args.budget, hedge=not args.no_hedge)
+    counts = run_batch(
+        list_images(args.source),
+        args.output,
+        predictor,
+        cache=None if args.no_cache else PredictionCache(),
+        store=ResultStore() if args.store else None,
+        concurrency=args.concurrency,
+        parse_workers=args.parse_workers,
+        confidence_threshold=args.confidence,
+    )
+    predictor.close()
+    pool.close()
+    print(f"{counts['done']} done, {counts['failed']} failed, {counts['skipped']} skipped (already in {args.output})")
@@ -0,0 +1,86 @@
+"""
+Measures how long a rerun of the dashboard takes and how many bytes of elements it sends to
+the browser, with a synthetic response of each size loaded in the session, by running the app
+headless with Streamlit's AppTest. The payload is the serialized size of every element of the
+page, what goes over the websocket on a full rerun.
+
+Usage:
+    python benchmarks/app_rerun.py --objects 100 1000 10000
+    python benchmarks/app_rerun.py --format dataframe --show-raw
+    git show HEAD~1:app.py > app_before.py && python benchmarks/app_rerun.py --app app_before.py
+"""
+import argparse
+import io
+import os
+import sys
+import time
+from statistics import median
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(ROOT)
+from PIL import Image
+from streamlit.testing.v1 import AppTest
+from extraction import NUTRITIONS, THRESHOLD, get_nutrition_values
+from extraction.columnar import ColumnarResponse
+from synthetic import synthetic_response
+
+# variables
+SIZES = [100, 1_000, 10_000]
+FORMATS = {"json": "json", "dataframe": "dataframe (editable)"}
+
+
+def payload_bytes(node):
+    """
+    Gets the serialized size of the elements under a node of the AppTest tree.
+    """
+    proto = getattr(node, "proto", None)
+    size = proto.ByteSize() if proto is not None and hasattr(proto, "ByteSize") else 0
+    children = getattr(node, "children", None) or {}
+    for child in children.values() if isinstance(children, dict) else children:
+        size += payload_bytes(child)
+    return size
+
+
+def measure(app, n_objects, format_option, show_raw, reruns):
+    """
+    Loads a synthetic response of `n_objects` objects in the session and reruns the app.
+
+    Returns:
+        tuple: The median seconds of a rerun and the payload of the page in bytes.
+    """
+    response = synthetic_response(n_objects)
+    image = io.BytesIO()
+    Image.new("RGB", (400, 600), "white").save(image, format="PNG")
+    image.name = "label.png"
+
+    at = AppTest.from_file(os.path.abspath(app), default_timeout=600)
+    at.session_state["uploaded_file"] = image
+    at.session_state["raw_response"] = ColumnarResponse.from_response(response)
+    at.session_state["nutrition_data"] = get_nutrition_values(response, NUTRITIONS, THRESHOLD)
+    at.session_state["show_raw_response"] = show_raw
+    at.run()
+    at.selectbox[0].set_value(FORMATS[format_option]).run()
+    if at.exception:
+        raise RuntimeError(at.exception[0].value)
+
+    times = []
+    for _ in range(reruns):
+        start = time.perf_counter()
+        at.run()
+        times.append(time.perf_counter() - start)
+    return median(times), payload_bytes(at._tree)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", default=os.path.join(ROOT, "app.py"), help="dashboard script to measure")
+    parser.add_argument("--objects", type=int, nargs="+", default=SIZES, help="numbers of objects per response")
+    parser.add_argument("--format", choices=list(FORMATS), default="json", help="result format selected")
+    parser.add_argument("--show-raw", action="store_true", help="open the browser of the detected objects")
+    parser.add_argument("--reruns", type=int, default=5, help="reruns timed per size")
+    args = parser.parse_args()
+
+    print(f"{'objects':>8} {'rerun ms':>10} {'payload KiB':>12}")
+    for n_objects in args.objects:
+        seconds, size = measure(args.app, n_objects, args.format, args.show_raw, args.reruns)
+        print(f"{n_objects:>8} {seconds * 1000:>10.1f} {size / 1024:>12.1f}")
@@ -0,0 +1,58 @@
+"""
+Measures the p50/p95 latency of EyePop predictions when every request opens its own
+endpoint (the old behaviour) versus borrowing a warm endpoint from the EndpointPool.
+
+Usage:
+    python benchmarks/endpoint_latency.py assets/uploads/uploaded_image.png -n 50 --concurrency 4
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from endpoint_pool import EndpointPool
+from extraction.metrics import percentile
+
+
+def timed(request):
+    start = time.perf_counter()
+    request()
+    return time.perf_counter() - start
+
+
+def per_request(filepath):
+    from eyepop import EyePopSdk
+
+    with EyePopSdk.endpoint() as endpoint:
+        endpoint.upload(filepath).predict()
+
+
+def measure(request, n, concurrency):
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(lambda _: timed(request), range(n)))
+
+
+def report(name, latencies):
+    print(
+        f"{name:<12} n={len(latencies):<4} "
+        f"p50={percentile(latencies, 50) * 1000:8.1f}ms  p95={percentile(latencies, 95) * 1000:8.1f}ms"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("image", help="image to send for every request")
+    parser.add_argument("-n", type=int, default=20, help="number of requests per mode")
+    parser.add_argument("--concurrency", type=int, default=1, help="number of concurrent clients")
+    args = parser.parse_args()
+    load_dotenv()
+
+    report("per-request", measure(lambda: per_request(args.image), args.n, args.concurrency))
+
+    pool = EndpointPool(size=args.concurrency)
+    pool.predict(args.image)  # warm up, like a long running dashboard process
+    report("pooled", measure(lambda: pool.predict(args.image), args.n, args.concurrency))
+    pool.close()
@@ -0,0 +1,67 @@
+"""
+Measures how long a fresh interpreter takes to import each entry point of the project, and
+which heavy libraries it loads on the way, to check that the tools which only parse responses
+do not pay for Streamlit, the EyePop SDK or NumPy.
+
+Usage:
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --modules extraction helpers --runs 20
+"""
+import argparse
+import os
+import subprocess
+import sys
+from statistics import median
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# variables
+MODULES = ["extraction", "extraction.columnar", "reextract", "batch", "endpoint_pool", "helpers"]
+HEAVY = ["streamlit", "eyepop", "numpy", "pandas", "PIL"]
+RUNS = 10
+
+SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(elapsed, *[name for name in {heavy!r} if name in sys.modules])
+"""
+
+
+def import_time(module, runs=RUNS):
+    """
+    Imports the module in `runs` fresh interpreters.
+
+    Returns:
+        tuple: The median import time in seconds and the heavy libraries the import loaded.
+    """
+    times = []
+    loaded = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", SCRIPT.format(module=module, heavy=HEAVY)],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.split()
+        times.append(float(output[0]))
+        loaded = output[1:]
+    return median(times), loaded
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modules", nargs="+", default=MODULES, help="modules to import")
+    parser.add_argument("--runs", type=int, default=RUNS, help="fresh interpreters per module")
+    args = parser.parse_args()
+
+    print(f"{'module':<22} {'median ms':>10}  heavy libraries loaded")
+    for module in args.modules:
+        try:
+            seconds, loaded = import_time(module, args.runs)
+        except subprocess.CalledProcessError as e:
+            print(f"{module:<22} {'failed':>10}  {e.stderr.strip().splitlines()[-1]}")
+            continue
+        print(f"{module:<22} {seconds * 1000:>10.1f}  {', '.join(loaded) or '-'}")
@@ -0,0 +1,164 @@
+"""
+Drives N concurrent simulated clients through the prediction pipeline against the local fake
+endpoint and reports the throughput and p50/p95/p99 latency of each stage.
+
+Usage:
+    python benchmarks/loadtest.py --clients 16 --requests 50 --pool-size 4 --predict-median 0.8 --error-rate 0.01
+    python benchmarks/loadtest.py --responses recorded.jsonl --images "for video/Nutrition Label Reader Video/images" --downscale
+    python benchmarks/loadtest.py --sigma 1.2 --budget 5 --hedge     # latency budget, retries and hedging
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from endpoint_pool import EndpointPool
+from extraction import NUTRITIONS, THRESHOLD, nutrition_values_to_json, parse_result
+from extraction.metrics import METRICS, percentile
+from fake_endpoint import SAMPLE_RESPONSES, fake_endpoint_factory, lognormal, load_responses
+from resilience import ResilientPredictor
+
+STAGES = ["downscale", "predict", "parse", "to_json", "total"]
+
+
+class StageTimer:
+    """
+    Collects the latencies of every pipeline stage across the client threads.
+    """
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self.latencies[stage].append(seconds)
+
+    def error(self):
+        with self._lock:
+            self.errors += 1
+
+
+def client(client_id, requests, images, pool, timer, downscale):
+    """
+    Sends `requests` images one after the other, `pool` being an `EndpointPool` or a `ResilientPredictor`.
+    """
+    for i in range(requests):
+        image_bytes = images[(client_id + i) % len(images)] if images else f"client {client_id} request {i}".encode()
+        start = time.perf_counter()
+        try:
+            mime_type, scale = "image/png", None
+            if downscale:
+                from preprocess import downscale_image
+
+                image_bytes, mime_type, scale = downscale_image(image_bytes)
+                timer.record("downscale", time.perf_counter() - start)
+
+            stage = time.perf_counter()
+            response = pool.predict_bytes(image_bytes, mime_type)
+            if scale is not None:
+                from preprocess import rescale_response
+
+                response = rescale_response(response, scale)
+            timer.record("predict", time.perf_counter() - stage)
+
+            stage = time.perf_counter()
+            extracted = parse_result(response.get("objects", []), NUTRITIONS, THRESHOLD)
+            timer.record("parse", time.perf_counter() - stage)
+
+            stage = time.perf_counter()
+            nutrition_values_to_json(extracted)
+            timer.record("to_json", time.perf_counter() - stage)
+        except Exception:
+            timer.error()
+            continue
+        timer.record("total", time.perf_counter() - start)
+
+
+def run(clients, requests, pool, images=None, downscale=False):
+    """
+    Runs `clients` concurrent clients sending `requests` requests each.
+
+    Returns:
+        tuple: The `StageTimer` and the wall clock duration in seconds.
+    """
+    timer = StageTimer()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        for client_id in range(clients):
+            executor.submit(client, client_id, requests, images, pool, timer, downscale)
+    return timer, time.perf_counter() - start
+
+
+def report(timer, duration):
+    completed = len(timer.latencies["total"])
+    print(f"{completed} requests in {duration:.2f}s, {completed / duration:.1f} req/s, {timer.errors} errors")
+    print(f"{'stage':<10} {'n':>7} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10}")
+    for stage in STAGES:
+        latencies = timer.latencies.get(stage)
+        if not latencies:
+            continue
+        print(
+            f"{stage:<10} {len(latencies):>7} "
+            + " ".join(f"{percentile(latencies, pct) * 1000:>10.2f}" for pct in (50, 95, 99))
+        )
+    counters = {
+        name: int(value)
+        for name, value in METRICS.counters.items()
+        if name in ("prediction_retries", "hedged_requests", "hedges_skipped", "hedge_wins", "budget_exceeded", "circuit_opened", "circuit_rejected")
+    }
+    if counters:
+        print(", ".join(f"{name}: {value}" for name, value in sorted(counters.items())))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=8, help="number of concurrent clients")
+    parser.add_argument("--requests", type=int, default=25, help="requests per client")
+    parser.add_argument("--pool-size", type=int, default=4, help="number of pooled endpoints")
+    parser.add_argument("--responses", default=SAMPLE_RESPONSES, help="recorded responses to replay")
+    parser.add_argument("--images", help="directory of images to send, synthetic bytes by default")
+    parser.add_argument("--downscale", action="store_true", help="downscale the images before upload, needs --images")
+    parser.add_argument("--connect-median", type=float, default=0.5, help="median seconds to connect")
+    parser.add_argument("--upload-median", type=float, default=0.05, help="median seconds to upload")
+    parser.add_argument("--predict-median", type=float, default=0.3, help="median seconds to predict")
+    parser.add_argument("--sigma", type=float, default=0.5, help="spread of the lognormal latencies")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="probability of a failed prediction")
+    parser.add_argument("--seed", type=int, default=None, help="seed of the simulated latencies and errors")
+    parser.add_argument("--budget", type=float, default=None, help="latency budget in seconds, enables retries")
+    parser.add_argument("--max-attempts", type=int, default=3, help="attempts per request within the budget")
+    parser.add_argument("--hedge", action="store_true", help="hedge requests slower than the recent p95")
+    args = parser.parse_args()
+    if args.downscale and not args.images:
+        parser.error("--downscale needs --images, the synthetic bytes are not images")
+
+    images = None
+    if args.images:
+        images = []
+        for name in sorted(os.listdir(args.images)):
+            with open(os.path.join(args.images, name), "rb") as f:
+                images.append(f.read())
+
+    factory = fake_endpoint_factory(
+        responses=load_responses(args.responses),
+        connect_latency=lognormal(args.connect_median, args.sigma),
+        upload_latency=lognormal(args.upload_median, args.sigma),
+        predict_latency=lognormal(args.predict_median, args.sigma),
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+    pool = EndpointPool(size=args.pool_size, factory=factory)
+    predictor = pool
+    if args.budget is not None or args.hedge:
+        predictor = ResilientPredictor(
+            pool, budget=args.budget, max_attempts=args.max_attempts, hedge=args.hedge, seed=args.seed
+        )
+    report(*run(args.clients, args.requests, predictor, images, args.downscale))
+    if predictor is not pool:
+        predictor.close()
+    pool.close()
@@ -0,0 +1,186 @@
+"""
+Times each stage of the parsing pipeline (parse_result on dictionaries and on the columnar
+form, clean_nutrition_values, nutrition_values_to_json and get_nutrition_values end to end)
+on synthetic responses of growing size, measures their peak memory with tracemalloc, and
+compares against a baseline.
+
+Usage:
+    python benchmarks/parse_bench.py --save-baseline     # record benchmarks/baseline.json
+    python benchmarks/parse_bench.py                     # compare, exits 1 on a regression
+    python benchmarks/parse_bench.py --sizes 10 1000 --columns 3 --missing-texts 0.05
+    python benchmarks/parse_bench.py --keywords 9 100 500 2000   # keyword matching vs vocabulary size
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import sys
+import time
+import tracemalloc
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from extraction import (
+    NUTRITIONS,
+    THRESHOLD,
+    clean_nutrition_values,
+    compile_nutrition_matcher,
+    get_nutrition_values,
+    nutrition_values_to_json,
+    parse_result,
+    search_nutrition_keyword,
+)
+from extraction.columnar import ColumnarResponse
+from synthetic import synthetic_response
+
+# variables
+SIZES = [10, 100, 1_000, 10_000, 100_000]
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+TOLERANCE = 0.25  # slower than the baseline by more than this fraction is a regression
+
+
+def stages(response):
+    """
+    Gets the stages to benchmark on a response, as name -> callable without arguments.
+    """
+    objects = response["objects"]
+    extracted = parse_result(objects, NUTRITIONS, THRESHOLD)
+    columns = ColumnarResponse.from_response(response)
+    return {
+        "parse_result": lambda: parse_result(objects, NUTRITIONS, THRESHOLD),
+        "to_columnar": lambda: ColumnarResponse.from_response(response),
+        "parse_columnar": lambda: parse_result(columns, NUTRITIONS, THRESHOLD),
+        "clean_nutrition_values": lambda: [clean_nutrition_values(nutr["values"]) for nutr in extracted],
+        "nutrition_values_to_json": lambda: nutrition_values_to_json(extracted),
+        "get_nutrition_values": lambda: get_nutrition_values(response, NUTRITIONS, THRESHOLD),
+    }
+
+
+def time_stage(stage, min_time=0.2, repeats=5):
+    """
+    Gets the best time per call in seconds over `repeats` runs of at least `min_time` seconds each.
+    """
+    calls = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(calls):
+            stage()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or calls >= 1_000_000:
+            break
+        calls *= 10 if elapsed < min_time / 10 else 2
+
+    best = elapsed / calls
+    for _ in range(repeats - 1):
+        start = time.perf_counter()
+        for _ in range(calls):
+            stage()
+        best = min(best, (time.perf_counter() - start) / calls)
+    return best
+
+
+def peak_memory(stage):
+    """
+    Gets the peak memory in bytes allocated while running the stage once.
+    """
+    tracemalloc.start()
+    try:
+        stage()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run(sizes, columns, jitter, missing_texts, min_time):
+    """
+    Runs every stage on a synthetic response of each size.
+
+    Returns:
+        dict: '<stage>@<size>' -> {'seconds', 'peak_bytes'}.
+    """
+    results = {}
+    for size in sizes:
+        response = synthetic_response(size, columns, jitter, missing_texts)
+        for name, stage in stages(response).items():
+            results[f"{name}@{size}"] = {
+                # fewer repeats on the large responses to keep the suite quick
+                "seconds": time_stage(stage, min_time, repeats=5 if size <= 10_000 else 2),
+                "peak_bytes": peak_memory(stage),
+            }
+            print(
+                f"{name:<26} {size:>7} objects  {results[f'{name}@{size}']['seconds'] * 1000:10.3f}ms"
+                f"  peak {results[f'{name}@{size}']['peak_bytes'] / 1024:10.1f} KiB"
+            )
+    return results
+
+
+def keyword_scaling(vocabulary_sizes, min_time, n_texts=1000):
+    """
+    Times the keyword matching per text against vocabularies of growing size (NUTRITIONS plus
+    random words), with the trie-factored matcher and with a plain alternation of the keywords.
+    """
+    rng = random.Random(0)
+    texts = [
+        obj["texts"][0]["text"] for obj in synthetic_response(n_texts)["objects"] if obj.get("texts")
+    ]
+    print(f"{'keywords':>8} {'trie us/text':>13} {'alternation us/text':>20}")
+    for size in vocabulary_sizes:
+        vocabulary = list(NUTRITIONS[:size])
+        while len(vocabulary) < size:
+            vocabulary.append("".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(5, 12))))
+        matcher = compile_nutrition_matcher(tuple(vocabulary))
+        alternation = re.compile("|".join(re.escape(word) for word in sorted(vocabulary, key=len, reverse=True)))
+        trie = time_stage(lambda: [search_nutrition_keyword(matcher, text) for text in texts], min_time)
+        plain = time_stage(lambda: [search_nutrition_keyword(alternation, text) for text in texts], min_time)
+        print(f"{size:>8} {trie / len(texts) * 1e6:>13.2f} {plain / len(texts) * 1e6:>20.2f}")
+
+
+def compare(results, baseline, tolerance):
+    """
+    Gets the benchmarks that are slower, or use more memory, than the baseline by more than `tolerance`.
+    """
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        for metric in ("seconds", "peak_bytes"):
+            ratio = result[metric] / max(baseline[key][metric], 1e-12)
+            if ratio > 1 + tolerance:
+                regressions.append(f"{key} {metric}: {ratio:.2f}x the baseline")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="numbers of objects per response")
+    parser.add_argument("--columns", type=int, default=2, help="value columns per row")
+    parser.add_argument("--jitter", type=float, default=2.0, help="pixels of random offset on 'y'")
+    parser.add_argument("--missing-texts", type=float, default=0.01, help="fraction of objects without 'texts'")
+    parser.add_argument("--min-time", type=float, default=0.2, help="minimum seconds per timing run")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline file to compare with or save to")
+    parser.add_argument("--save-baseline", action="store_true", help="save the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="allowed slowdown before flagging")
+    parser.add_argument("--keywords", type=int, nargs="+", help="only time the keyword matching with these vocabulary sizes")
+    args = parser.parse_args()
+
+    if args.keywords:
+        keyword_scaling(args.keywords, args.min_time)
+        sys.exit(0)
+
+    results = run(args.sizes, args.columns, args.jitter, args.missing_texts, args.min_time)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({"python": platform.python_version(), "results": results}, f, indent=2)
+        print(f"saved baseline to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)["results"], args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print("no regressions against the baseline")
+    else:
+        print(f"no baseline at {args.baseline}, run with --save-baseline to record one")
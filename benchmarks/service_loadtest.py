@@ -0,0 +1,135 @@
+"""
+Drives N concurrent HTTP clients against the extraction service and reports the throughput,
+the p50/p95/p99 latency, the answers by status and the mean batch size. Without --url the
+service is started in this process with the local fake endpoint.
+
+Usage:
+    python benchmarks/service_loadtest.py --clients 64 --requests 20 --window 0.01
+    python benchmarks/service_loadtest.py --responses-only --clients 256 --max-queue 64
+    python benchmarks/service_loadtest.py --url http://127.0.0.1:8080
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from collections import Counter
+from urllib.parse import urlsplit
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from endpoint_pool import EndpointPool
+from extraction.metrics import METRICS, percentile
+from fake_endpoint import SAMPLE_RESPONSES, fake_endpoint_factory, lognormal, load_responses
+from server import ExtractionServer, ExtractionService
+
+
+async def post(reader, writer, host, path, body, content_type):
+    """
+    Sends one request on a keep-alive connection and reads the answer.
+
+    Returns:
+        tuple: The status code and the decoded JSON body.
+    """
+    writer.write(
+        f"POST {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: {content_type}\r\n"
+        f"Content-Length: {len(body)}\r\n\r\n".encode("latin-1") + body
+    )
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.lower() == "content-length":
+            length = int(value)
+    return status, json.loads(await reader.readexactly(length))
+
+
+async def client(client_id, url, requests, bodies, latencies, statuses):
+    """
+    Sends `requests` requests one after the other on one connection.
+    """
+    url = urlsplit(url)
+    reader, writer = await asyncio.open_connection(url.hostname, url.port)
+    rng = random.Random(client_id)
+    try:
+        for _ in range(requests):
+            body, content_type = rng.choice(bodies)
+            start = time.perf_counter()
+            status, _ = await post(reader, writer, url.netloc, "/extract", body, content_type)
+            statuses[status] += 1
+            if status == 200:
+                latencies.append(time.perf_counter() - start)
+    finally:
+        writer.close()
+
+
+async def run(args):
+    responses = load_responses(args.responses)
+    if args.responses_only:
+        bodies = [(json.dumps(response).encode(), "application/json") for response in responses]
+    else:
+        # distinct fake images, the fake endpoint answers each with one of the recorded responses
+        bodies = [(f"image {i}".encode(), "image/png") for i in range(args.images)]
+
+    server = None
+    url = args.url
+    if url is None:
+        factory = fake_endpoint_factory(
+            responses=responses, predict_latency=lognormal(args.predict_median, args.sigma), seed=0
+        )
+        service = ExtractionService(
+            EndpointPool(size=args.pool_size, factory=factory),
+            window=args.window,
+            max_batch=args.max_batch,
+            max_batches=args.max_batches,
+            max_queue=args.max_queue,
+            parse_workers=args.parse_workers,
+            downscale=False,
+        )
+        await service.start()
+        server = await asyncio.start_server(ExtractionServer(service).handle, "127.0.0.1", 0)
+        url = f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}"
+
+    latencies, statuses = [], Counter()
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(client(i, url, args.requests, bodies, latencies, statuses) for i in range(args.clients))
+    )
+    duration = time.perf_counter() - start
+
+    print(f"{len(latencies)} requests in {duration:.2f}s, {len(latencies) / duration:.1f} req/s")
+    print(", ".join(f"{status}: {count}" for status, count in sorted(statuses.items())))
+    if latencies:
+        print(" ".join(f"p{pct} {percentile(latencies, pct) * 1000:.1f} ms" for pct in (50, 95, 99)))
+    if server is not None:
+        batches = METRICS.observations.get("service_batch_size")
+        if batches:
+            print(f"{batches['count']} batches, {batches['sum'] / batches['count']:.1f} requests per batch")
+        server.close()
+        await server.wait_closed()
+        await service.close()
+        service.predictor.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="address of a running service, one is started with the fake endpoint by default")
+    parser.add_argument("--clients", type=int, default=32, help="number of concurrent clients")
+    parser.add_argument("--requests", type=int, default=20, help="requests per client")
+    parser.add_argument("--responses", default=SAMPLE_RESPONSES, help="recorded responses to replay")
+    parser.add_argument("--responses-only", action="store_true", help="post recorded responses instead of images")
+    parser.add_argument("--images", type=int, default=200, help="number of distinct fake images")
+    parser.add_argument("--pool-size", type=int, default=8, help="number of pooled endpoints")
+    parser.add_argument("--predict-median", type=float, default=0.1, help="median seconds to predict")
+    parser.add_argument("--sigma", type=float, default=0.5, help="spread of the lognormal latencies")
+    parser.add_argument("--window", type=float, default=0.01, help="seconds a batch waits for more requests")
+    parser.add_argument("--max-batch", type=int, default=32, help="maximum number of requests in a batch")
+    parser.add_argument("--max-batches", type=int, default=4, help="maximum number of batches in flight")
+    parser.add_argument("--max-queue", type=int, default=256, help="requests waiting before new ones are refused")
+    parser.add_argument("--parse-workers", type=int, default=None, help="number of parsing processes")
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,74 @@
+"""
+Generates synthetic responses shaped like the ones from the EyePop API: rows of a nutrition
+label with the nutrition name on the left and one or more columns of values to its right.
+"""
+import random
+
+ROW_HEIGHT = 18  # pixels between two rows, above THRESHOLD so rows do not bleed into each other
+NAMES = [
+    "Calories", "Total Fat", "Saturated Fat", "Trans Fat", "Cholesterol", "Sodium",
+    "Total Carbohydrate", "Dietary Fiber", "Total Sugars", "Protein", "Vitamin D", "Calcium", "Iron",
+]
+UNITS = ["g", "mg", "%"]
+
+
+def text_object(obj_id, text, x, y, confidence, rng, missing_texts):
+    obj = {
+        "category": "text",
+        "classId": 0,
+        "classLabel": "text",
+        "confidence": confidence,
+        "height": 11.0,
+        "id": obj_id,
+        "orientation": 0,
+        "width": 8.0 * len(text),
+        "x": x,
+        "y": y,
+    }
+    # EyePop sometimes returns a text object without its 'texts'
+    if rng.random() >= missing_texts:
+        obj["texts"] = [{"category": "text", "confidence": round(rng.uniform(0.8, 1.0), 3), "id": obj_id, "text": text}]
+    return obj
+
+
+def synthetic_response(n_objects, columns=2, jitter=2.0, missing_texts=0.01, seed=0):
+    """
+    Generates a response with `n_objects` objects laid out as the rows of nutrition labels.
+
+    Args:
+        n_objects (int): Number of objects in the response.
+        columns (int): Number of value columns on each row (e.g. per serving and per container).
+        jitter (float): Maximum random offset in pixels of the 'y' of each object from its row.
+        missing_texts (float): Probability that an object has no 'texts'.
+        seed (int): Seed of the generator, the same arguments always give the same response.
+
+    Returns:
+        dict: A response with an 'objects' list, like the EyePop API returns.
+    """
+    rng = random.Random(seed)
+    objects = []
+    row = 0
+    while len(objects) < n_objects:
+        y = row * ROW_HEIGHT
+        cells = [(rng.choice(NAMES), 5.0)]
+        for column in range(columns):
+            x = 150.0 + column * 110.0
+            unit = rng.choice(UNITS)
+            value = str(rng.randint(0, 500))
+            if rng.random() < 0.3:
+                # value and unit read as two separate objects
+                cells += [(value, x), (unit, x + 8.0 * len(value))]
+            else:
+                cells.append((value + unit, x))
+        for text, x in cells:
+            if len(objects) == n_objects:
+                break
+            objects.append(
+                text_object(
+                    len(objects), text, x, y + rng.uniform(-jitter, jitter), round(rng.uniform(0.3, 1.0), 3), rng, missing_texts
+                )
+            )
+        row += 1
+
+    rng.shuffle(objects)  # EyePop does not return the objects in reading order
+    return {"objects": objects, "source_height": row * ROW_HEIGHT, "source_width": 150 + columns * 110}
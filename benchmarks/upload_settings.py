@@ -0,0 +1,68 @@
+"""
+Reports the bytes saved by each upload setting (max dimension, format, quality) and, with
+--predict, the end-to-end latency of a prediction made with it.
+
+Usage:
+    python benchmarks/upload_settings.py "for video/Nutrition Label Reader Video/images/label 2.jpg" --predict
+"""
+import argparse
+import itertools
+import os
+import sys
+import time
+from dotenv import load_dotenv
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from preprocess import downscale_image, rescale_response, settings_id
+
+MAX_DIMS = [0, 2048, 1600, 1280, 1024]
+FORMATS = ["JPEG", "WEBP"]
+QUALITIES = [90, 80, 70]
+
+
+def measure(image_bytes, max_dim, image_format, quality, pool=None):
+    """
+    Gets the size and timings of uploading the image with the given settings.
+    """
+    start = time.perf_counter()
+    upload_bytes, mime_type, scale = downscale_image(image_bytes, max_dim, image_format, quality)
+    encoded = time.perf_counter()
+    if pool is not None:
+        rescale_response(pool.predict_bytes(upload_bytes, mime_type), scale)
+    done = time.perf_counter()
+    return {
+        "setting": settings_id(max_dim, image_format, quality),
+        "bytes": len(upload_bytes),
+        "saved": 1 - len(upload_bytes) / len(image_bytes),
+        "encode_ms": (encoded - start) * 1000,
+        "total_ms": (done - start) * 1000 if pool is not None else None,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", nargs="+", help="images to measure")
+    parser.add_argument("--predict", action="store_true", help="also send each setting to EyePop")
+    args = parser.parse_args()
+
+    pool = None
+    if args.predict:
+        load_dotenv()
+        from endpoint_pool import EndpointPool
+
+        pool = EndpointPool(size=1)
+
+    for filepath in args.images:
+        with open(filepath, "rb") as f:
+            image_bytes = f.read()
+        print(f"{filepath} ({len(image_bytes) / 1024:.0f} KiB)")
+        for max_dim, image_format, quality in itertools.product(MAX_DIMS, FORMATS, QUALITIES):
+            result = measure(image_bytes, max_dim, image_format, quality, pool)
+            total = f"{result['total_ms']:9.1f}ms" if result["total_ms"] is not None else ""
+            print(
+                f"  {result['setting']:<16} {result['bytes'] / 1024:8.0f} KiB  "
+                f"saved {result['saved']:6.1%}  encode {result['encode_ms']:7.1f}ms {total}"
+            )
+
+    if pool is not None:
+        pool.close()
@@ -0,0 +1,243 @@
+import io
+import mimetypes
+import os
+import queue
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from extraction.metrics import METRICS
+
+# variables
+POOL_SIZE = int(os.getenv("EYEPOP_POOL_SIZE", 2))
+POOL_MAX_IDLE = float(os.getenv("EYEPOP_POOL_MAX_IDLE", 300))  # seconds before a warm endpoint is recycled
+
+
+def predict_bytes(endpoint, image_bytes, mime_type="image/png"):
+    """
+    Uploads an in-memory image to the endpoint and gets the prediction, without going through
+    a shared file on disk. A temporary file private to this request is only written if the
+    endpoint cannot upload from a stream.
+
+    Args:
+        endpoint: A connected EyePop endpoint.
+        image_bytes (bytes): The raw bytes of the image.
+        mime_type (str): The mime type of the image, e.g. 'image/png'.
+
+    Returns:
+        dict: The response from the EyePop API.
+    """
+    if hasattr(endpoint, "upload_stream"):
+        with METRICS.timer("upload"):
+            # BytesIO shares the bytes buffer instead of copying it until it is written to
+            job = endpoint.upload_stream(io.BytesIO(image_bytes), mime_type)
+        with METRICS.timer("predict"):
+            return job.predict()
+
+    suffix = mimetypes.guess_extension(mime_type) or ""
+    with METRICS.timer("file_write"):
+        with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as f:
+            f.write(image_bytes)
+    try:
+        with METRICS.timer("upload"):
+            job = endpoint.upload(f.name)
+        with METRICS.timer("predict"):
+            return job.predict()
+    finally:
+        os.remove(f.name)
+
+
+class PooledEndpoint:
+    """
+    A connected EyePop endpoint kept warm by the pool.
+    """
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.last_used = time.monotonic()
+        self.uses = 0
+
+
+def eyepop_endpoint():
+    """
+    Creates a new EyePop endpoint. The SDK is only imported here, the first time a connection
+    is opened, so importing this module stays cheap for tools that never call the API.
+    """
+    from eyepop import EyePopSdk
+
+    return EyePopSdk.endpoint()
+
+
+class EndpointPool:
+    """
+    Process-wide pool of connected EyePop endpoints, so requests reuse warm connections
+    instead of paying the connection setup and worker acquisition every time.
+
+    At most `size` endpoints are in use at once, callers beyond that wait for one to be returned.
+    An endpoint that raises while in use is disconnected and replaced by a new connection.
+    """
+
+    def __init__(self, size=POOL_SIZE, factory=None, max_idle=POOL_MAX_IDLE, health_check=None):
+        """
+        Args:
+            size (int): Maximum number of connected endpoints.
+            factory (callable): Creates a new (not yet connected) endpoint, `EyePopSdk.endpoint` by default.
+            max_idle (float): Seconds an endpoint can sit unused before it is reconnected.
+            health_check (callable): Optional, called with an idle endpoint before reuse, falsy to reconnect it.
+        """
+        self.size = size
+        self.factory = factory or eyepop_endpoint
+        self.max_idle = max_idle
+        self.health_check = health_check
+        self.connects = 0
+        self.reconnects = 0
+        self.in_use = 0
+        self._lock = threading.Lock()
+        self._idle = queue.LifoQueue()  # the most recently used endpoint is the warmest
+        self._slots = threading.BoundedSemaphore(size)
+
+    @contextmanager
+    def endpoint(self):
+        """
+        Borrows a connected endpoint from the pool for the duration of the block.
+        """
+        with self._slot():
+            conn = self._checkout()
+            try:
+                yield conn.endpoint
+            except Exception:
+                # do not hand a possibly broken connection to the next caller
+                self._disconnect(conn)
+                raise
+            self._release(conn)
+
+    def predict(self, location, retry=True):
+        """
+        Uploads the image at `location` with a pooled endpoint and gets the prediction.
+
+        Args:
+            location (str): Path of the image to upload.
+            retry (bool): Whether to retry on a fresh connection when a reused one fails, see `run`.
+
+        Returns:
+            dict: The response from the EyePop API.
+        """
+        def request(endpoint):
+            with METRICS.timer("upload"):
+                job = endpoint.upload(location)
+            with METRICS.timer("predict"):
+                return job.predict()
+
+        return self.run(request, retry)
+
+    def predict_bytes(self, image_bytes, mime_type="image/png", retry=True):
+        """
+        Uploads an in-memory image with a pooled endpoint and gets the prediction.
+
+        Args:
+            image_bytes (bytes): The raw bytes of the image.
+            mime_type (str): The mime type of the image, e.g. 'image/png'.
+            retry (bool): Whether to retry on a fresh connection when a reused one fails, see `run`.
+
+        Returns:
+            dict: The response from the EyePop API.
+        """
+        return self.run(lambda endpoint: predict_bytes(endpoint, image_bytes, mime_type), retry)
+
+    def run(self, request, retry=True):
+        """
+        Calls `request` with a pooled endpoint. If a reused endpoint fails (e.g. the connection
+        went stale while idle), the request is retried once on a fresh connection, unless `retry`
+        is false: a caller with its own retries (`ResilientPredictor`) turns it off, otherwise
+        every one of its attempts could call the endpoint twice.
+        """
+        with self._slot():
+            conn = self._checkout()
+            try:
+                response = request(conn.endpoint)
+            except Exception:
+                self._disconnect(conn)
+                if conn.uses == 0 or not retry:
+                    raise  # a fresh connection failed, reconnecting would not help
+                self._count_reconnect()
+                conn = self._connect()
+                try:
+                    response = request(conn.endpoint)
+                except Exception:
+                    self._disconnect(conn)
+                    raise
+            self._release(conn)
+            return response
+
+    def available(self):
+        """
+        Gets the number of endpoints a request could use right now without waiting.
+        """
+        with self._lock:
+            return self.size - self.in_use
+
+    def close(self):
+        """
+        Disconnects every idle endpoint in the pool.
+        """
+        while True:
+            try:
+                self._disconnect(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+    @contextmanager
+    def _slot(self):
+        with self._slots:
+            with self._lock:
+                self.in_use += 1
+            try:
+                yield
+            finally:
+                with self._lock:
+                    self.in_use -= 1
+
+    def _checkout(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            if self._healthy(conn):
+                return conn
+            self._disconnect(conn)
+            self._count_reconnect()
+
+    def _release(self, conn):
+        conn.last_used = time.monotonic()
+        conn.uses += 1
+        self._idle.put(conn)
+
+    def _healthy(self, conn):
+        if time.monotonic() - conn.last_used > self.max_idle:
+            return False
+        try:
+            return self.health_check is None or bool(self.health_check(conn.endpoint))
+        except Exception:
+            return False
+
+    def _connect(self):
+        # same as entering `with EyePopSdk.endpoint() as endpoint:` but kept open across requests
+        with METRICS.timer("endpoint_connect"):
+            endpoint = self.factory()
+            endpoint = endpoint.__enter__() or endpoint
+        with self._lock:
+            self.connects += 1
+        METRICS.increment("endpoint_connects")
+        return PooledEndpoint(endpoint)
+
+    def _count_reconnect(self):
+        with self._lock:
+            self.reconnects += 1
+        METRICS.increment("endpoint_reconnects")
+
+    def _disconnect(self, conn):
+        try:
+            conn.endpoint.__exit__(None, None, None)
+        except Exception:
+            pass  # already broken, nothing left to clean up
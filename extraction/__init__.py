@@ -0,0 +1,25 @@
+"""
+Extraction of the nutrition values from EyePop responses, shared by the dashboard, the
+command line tools and their worker processes.
+
+Importing the package only loads the standard library. NumPy is loaded by
+`extraction.columnar`, once a response is converted to its columnar form. The values can
+be typed into `Quantity(amount, unit)` records with `normalize_nutrition`.
+"""
+from .parsing import (
+    NUTRITIONS,
+    THRESHOLD,
+    IncrementalParser,
+    build_row_index,
+    clean_nutrition_values,
+    compile_nutrition_matcher,
+    find_nutrition_keyword,
+    get_nutrition_values,
+    is_columnar,
+    lookup_row,
+    nutrition_values_to_json,
+    parse_result,
+    row_entries,
+    search_nutrition_keyword,
+)
+from .quantities import Quantity, normalize_nutrition, parse_quantity, parse_unit, quantity_cache_info, tokenize_values
@@ -0,0 +1,195 @@
+import numpy as np
+from .parsing import compile_nutrition_matcher, search_nutrition_keyword
+
+
+class ColumnarResponse:
+    """
+    Compact columnar form of the objects of an EyePop response: one NumPy array per field
+    instead of one nested dictionary per object, with every distinct text stored once.
+
+    Object `i` has its coordinates at `x[i]`, `y[i]`, `width[i]`, `height[i]`, its confidence at
+    `confidence[i]` and its text at `texts[text_ids[i]]` (an empty string when the object had no
+    'texts', which `has_texts[i]` tells apart).
+    """
+
+    __slots__ = ("ids", "x", "y", "width", "height", "confidence", "text_ids", "has_texts", "texts", "meta")
+
+    def __init__(self, ids, x, y, width, height, confidence, text_ids, has_texts, texts, meta=None):
+        self.ids = ids
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.confidence = confidence
+        self.text_ids = text_ids
+        self.has_texts = has_texts
+        self.texts = texts
+        self.meta = meta or {}
+
+    @classmethod
+    def from_response(cls, response):
+        """
+        Converts a response from the EyePop API to the columnar form.
+
+        Args:
+            response (dict): A dictionary containing the response object from the EyePop API.
+
+        Returns:
+            ColumnarResponse: The objects of the response as columns.
+        """
+        response_obj = response.get("objects", [])
+        interned = {}
+        text_ids = []
+        has_texts = []
+        for obj in response_obj:
+            texts = obj.get("texts")
+            text = texts[0].get("text", "") if texts else ""
+            text_ids.append(interned.setdefault(text, len(interned)))
+            has_texts.append(bool(texts))
+
+        def column(key, default=0.0):
+            return np.fromiter((obj.get(key, default) for obj in response_obj), dtype=np.float64, count=len(response_obj))
+
+        return cls(
+            ids=np.fromiter((obj.get("id", -1) for obj in response_obj), dtype=np.int64, count=len(response_obj)),
+            # objects without coordinates (e.g. low confidence ones) are at 0, like `obj.get("y", 0)`
+            x=column("x", 0),
+            y=column("y", 0),
+            width=column("width"),
+            height=column("height"),
+            confidence=column("confidence"),
+            text_ids=np.array(text_ids, dtype=np.int32),
+            has_texts=np.array(has_texts, dtype=bool),
+            texts=list(interned),
+            meta={key: value for key, value in response.items() if key != "objects"},
+        )
+
+    def to_response(self, start=0, stop=None):
+        """
+        Converts the objects back to the dictionaries of an EyePop response, e.g. to display them.
+        Only the fields kept in the columns are restored (id, confidence, box and text), the
+        others such as 'category', 'classLabel' or the confidence of the texts are not kept.
+
+        Args:
+            start (int): Position of the first object to convert.
+            stop (int): Position after the last object to convert, all the remaining ones by default.
+
+        Returns:
+            dict: The response with its 'objects' list.
+        """
+        return {**self.meta, "objects": self.objects(range(start, len(self) if stop is None else min(stop, len(self))))}
+
+    def objects(self, positions):
+        """
+        Converts the objects at the given positions back to dictionaries.
+
+        Args:
+            positions (iterable): Positions of the objects in the response, e.g. from `find`.
+
+        Returns:
+            list: The objects, in the order of `positions`.
+        """
+        objects = []
+        for i in positions:
+            obj = {
+                "id": int(self.ids[i]),
+                "confidence": float(self.confidence[i]),
+                "x": float(self.x[i]),
+                "y": float(self.y[i]),
+                "width": float(self.width[i]),
+                "height": float(self.height[i]),
+            }
+            if self.has_texts[i]:
+                obj["texts"] = [{"text": self.texts[self.text_ids[i]]}]
+            objects.append(obj)
+        return objects
+
+    def find(self, min_confidence=0.0, text=None):
+        """
+        Gets the positions of the objects with a confidence of at least `min_confidence` and,
+        if given, a text containing `text` (ignoring case).
+
+        Returns:
+            numpy.ndarray: The positions, in response order.
+        """
+        mask = self.confidence >= min_confidence
+        if text:
+            # matched once per distinct text instead of once per object
+            needle = text.lower()
+            matches = np.array([needle in value.lower() for value in self.texts], dtype=bool)
+            mask &= matches[self.text_ids]
+        return np.flatnonzero(mask)
+
+    def text_list(self):
+        """
+        Gets the text of every object, in response order.
+        """
+        return [self.texts[text_id] for text_id in self.text_ids.tolist()]
+
+    @property
+    def nbytes(self):
+        """
+        Approximate memory used by the columns and the text table, in bytes.
+        """
+        arrays = (self.ids, self.x, self.y, self.width, self.height, self.confidence, self.text_ids, self.has_texts)
+        return sum(array.nbytes for array in arrays) + sum(len(text) + 49 for text in self.texts)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __eq__(self, other):
+        if not isinstance(other, ColumnarResponse):
+            return NotImplemented
+        return (
+            self.texts == other.texts
+            and self.meta == other.meta
+            and all(
+                np.array_equal(getattr(self, name), getattr(other, name))
+                for name in ("ids", "x", "y", "width", "height", "confidence", "text_ids", "has_texts")
+            )
+        )
+
+    __hash__ = None
+
+
+def parse_columnar(columns, nutritions, threshold, confidence_threshold=0.5):
+    """
+    Same as `parse_result`, on the columnar form of the response, with the filtering and the
+    row lookups done on whole arrays at once.
+
+    Args:
+        columns (ColumnarResponse): The objects of the response as columns.
+        nutritions (list): Keywords representing the nutrition to look for.
+        threshold (int or float): Threshold for proximity in 'y' values.
+        confidence_threshold (float): Minimum confidence level for valid objects.
+
+    Returns:
+        list: Extracted nutritional information as a list of dictionaries.
+    """
+    # positions of the valid objects, in response order
+    valid = np.flatnonzero(columns.confidence >= confidence_threshold)
+
+    # the keywords are matched once per distinct text instead of once per object
+    matcher = compile_nutrition_matcher(tuple(nutritions))
+    is_nutrition = np.array(
+        [search_nutrition_keyword(matcher, text) is not None for text in columns.texts], dtype=bool
+    )
+    nutrition_pos = valid[is_nutrition[columns.text_ids[valid]]]
+
+    # an object is on the row when obj['y'] - threshold <= y <= obj['y'] + threshold
+    by_y = valid[np.argsort(columns.y[valid], kind="stable")]
+    row_y = columns.y[nutrition_pos]
+    starts = np.searchsorted(columns.y[by_y] + threshold, row_y, side="left")
+    ends = np.searchsorted(columns.y[by_y] - threshold, row_y, side="right")
+
+    extracted_nutrition = []
+    for pos, start, end in zip(nutrition_pos.tolist(), starts.tolist(), ends.tolist()):
+        row = by_y[start:end]
+        row = row[np.lexsort((row, columns.x[row]))]  # sort by 'x', ties in response order
+        nutrition_id = columns.text_ids[pos]
+        # handle case where the value is the same as the nutrition
+        row_text_ids = columns.text_ids[row]
+        extracted_vals = [columns.texts[text_id] for text_id in row_text_ids[row_text_ids != nutrition_id].tolist()]
+        extracted_nutrition.append({"nutrition": columns.texts[nutrition_id], "values": extracted_vals})
+
+    return extracted_nutrition
@@ -0,0 +1,186 @@
+import math
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# variables
+PREFIX = "label_reader"
+# upper bounds in seconds of the histogram buckets of the stage timers
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+RECENT = 1000  # durations kept per stage for the percentiles
+
+_current_request = ContextVar("current_request", default=None)
+
+
+def percentile(values, pct):
+    """
+    Gets the given percentile (0-100) of the values, using the nearest rank.
+    """
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    # pct * n / 100 rather than pct / 100 * n, e.g. 7 / 100 * 100 is 7.000000000000001
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct * len(ordered) / 100) - 1))
+    return ordered[rank]
+
+
+class Metrics:
+    """
+    Timers per pipeline stage, counters and observed values, plus a trace of the last requests,
+    to tell whether time goes to the network (connect, upload, predict) or to the CPU (parsing).
+
+    Stages timed inside `request()` are also added to that request's trace, from any function
+    called within it, so the code being timed does not need to pass anything around.
+    """
+
+    def __init__(self, history=50):
+        self.history = history
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Clears every metric.
+        """
+        with self._lock:
+            self.stages = defaultdict(lambda: {"count": 0, "sum": 0.0, "buckets": [0] * len(BUCKETS)})
+            self.recent = defaultdict(lambda: deque(maxlen=RECENT))
+            self.counters = defaultdict(float)
+            self.observations = defaultdict(lambda: {"count": 0, "sum": 0.0, "last": 0.0})
+            self.requests = deque(maxlen=self.history)
+
+    @contextmanager
+    def timer(self, stage):
+        """
+        Times the block as the given pipeline stage.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def record(self, stage, seconds):
+        """
+        Records a duration of the given stage, in seconds.
+        """
+        with self._lock:
+            stats = self.stages[stage]
+            stats["count"] += 1
+            stats["sum"] += seconds
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    stats["buckets"][i] += 1
+            self.recent[stage].append(seconds)
+        request = _current_request.get()
+        if request is not None:
+            request["stages"][stage] = request["stages"].get(stage, 0.0) + seconds
+
+    def increment(self, name, value=1):
+        """
+        Increments a counter, e.g. 'cache_hits'.
+        """
+        with self._lock:
+            self.counters[name] += value
+
+    def observe(self, name, value):
+        """
+        Records a value, e.g. the number of objects in a response.
+        """
+        with self._lock:
+            stats = self.observations[name]
+            stats["count"] += 1
+            stats["sum"] += value
+            stats["last"] = value
+        self.annotate(name, value)
+
+    def annotate(self, key, value):
+        """
+        Adds a value to the trace of the current request, if any.
+        """
+        request = _current_request.get()
+        if request is not None:
+            request[key] = value
+
+    @contextmanager
+    def request(self, name="request"):
+        """
+        Traces the block as one request, kept with the last `history` requests.
+        """
+        request = {"name": name, "started": time.time(), "stages": {}}
+        token = _current_request.set(request)
+        start = time.perf_counter()
+        try:
+            yield request
+        except Exception as e:
+            request["error"] = type(e).__name__
+            raise
+        finally:
+            request["total"] = time.perf_counter() - start
+            _current_request.reset(token)
+            with self._lock:
+                self.requests.append(request)
+
+    def last_requests(self, n=None):
+        """
+        Gets the traces of the last `n` requests, most recent first.
+        """
+        with self._lock:
+            requests = list(self.requests)
+        return requests[::-1][:n]
+
+    def to_json(self):
+        """
+        Exports the metrics as a JSON serializable dictionary.
+        """
+        with self._lock:
+            stages = {
+                stage: {
+                    "count": stats["count"],
+                    "sum": stats["sum"],
+                    "p50": percentile(self.recent[stage], 50),
+                    "p95": percentile(self.recent[stage], 95),
+                    "p99": percentile(self.recent[stage], 99),
+                }
+                for stage, stats in self.stages.items()
+            }
+            counters = dict(self.counters)
+            observations = {name: dict(stats) for name, stats in self.observations.items()}
+        lookups = counters.get("cache_hits", 0) + counters.get("cache_misses", 0)
+        return {
+            "stages": stages,
+            "counters": counters,
+            "cache_hit_rate": counters.get("cache_hits", 0) / lookups if lookups else 0.0,
+            "observations": observations,
+            "requests": self.last_requests(),
+        }
+
+    def to_prometheus(self):
+        """
+        Exports the metrics in the Prometheus text exposition format.
+        """
+        lines = [
+            f"# HELP {PREFIX}_stage_seconds Time spent in each stage of the pipeline.",
+            f"# TYPE {PREFIX}_stage_seconds histogram",
+        ]
+        with self._lock:
+            for stage, stats in sorted(self.stages.items()):
+                for bound, count in zip(BUCKETS, stats["buckets"]):
+                    lines.append(f'{PREFIX}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+                lines.append(f'{PREFIX}_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {stats["count"]}')
+                lines.append(f'{PREFIX}_stage_seconds_sum{{stage="{stage}"}} {stats["sum"]}')
+                lines.append(f'{PREFIX}_stage_seconds_count{{stage="{stage}"}} {stats["count"]}')
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"# TYPE {PREFIX}_{name}_total counter")
+                lines.append(f"{PREFIX}_{name}_total {value}")
+            for name, stats in sorted(self.observations.items()):
+                lines.append(f"# TYPE {PREFIX}_{name} summary")
+                lines.append(f"{PREFIX}_{name}_sum {stats['sum']}")
+                lines.append(f"{PREFIX}_{name}_count {stats['count']}")
+        return "\n".join(lines) + "\n"
+
+
+# shared by everything running in the process
+METRICS = Metrics()
@@ -0,0 +1,381 @@
+import re
+import sys
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+from .metrics import METRICS
+
+# variables
+units = {'mg', 'g', '%', 'kg', 'lb', 'oz'}
+
+NUTRITIONS = [
+    'protein', 'fat', 'calories', 'sugar', 'sodium', 'fiber', 'carbohydrate', 'cholesterol', 'carbs'
+]
+THRESHOLD = 10
+
+# a token with a letter and no digit, i.e. a word of the nutrition name rather than a value
+_WORD = re.compile(r"[^0-9]*[A-Za-z][^0-9]*", re.DOTALL)
+
+
+def is_columnar(response):
+    """
+    Whether the response is a `ColumnarResponse`, checked without importing NumPy: a columnar
+    response can only exist once `extraction.columnar` has been imported.
+    """
+    columnar = sys.modules.get(f"{__package__}.columnar")
+    return columnar is not None and isinstance(response, columnar.ColumnarResponse)
+
+
+def get_nutrition_values(response, nutritions, threshold, confidence_threshold=0.5):
+    """
+    Extracts nutritional information from the response based on the given nutrition strings and threshold.
+
+    Args:
+        response (dict or ColumnarResponse): A dictionary containing the response object from the EyePop API,
+            or its columnar form.
+        nutritions (list): A list of strings representing the nutrition keywords to look for.
+        threshold (int or float): The threshold value to determine proximity in 'y' values.
+        confidence_threshold (float): Minimum confidence level for valid objects.
+
+    Returns:
+        dict: A dictionary with the nutritional information in a JSON format.
+    """
+    # the columnar form is parsed directly, without going back to dictionaries
+    response_obj = response if is_columnar(response) else response.get("objects", [])
+    METRICS.observe("response_objects", len(response_obj))
+    with METRICS.timer("parse_result"):
+        extracted_nutrition = parse_result(
+            response_obj, nutritions, threshold, confidence_threshold
+        )
+    with METRICS.timer("nutrition_values_to_json"):
+        return nutrition_values_to_json(extracted_nutrition)
+
+
+def parse_result(response_obj, nutritions, threshold, confidence_threshold=0.5):
+    """
+    Parses the response object to extract nutritional information based on given nutrition strings and a threshold.
+
+    Args:
+        response_obj (list or ColumnarResponse): List of objects containing text and 'y' value information.
+        nutritions (list): Keywords representing the nutrition to look for.
+        threshold (int or float): Threshold for proximity in 'y' values.
+        confidence_threshold (float): Minimum confidence level for valid objects.
+
+    Returns:
+        list: Extracted nutritional information as a list of dictionaries.
+    """
+    if is_columnar(response_obj):
+        from .columnar import parse_columnar
+
+        return parse_columnar(response_obj, nutritions, threshold, confidence_threshold)
+
+    # apply the confidence filter once, every later step only sees valid objects
+    valid_objs = [
+        obj for obj in response_obj if obj.get("confidence", 0) >= confidence_threshold
+    ]
+
+    # get all the objects that contain nutrition information
+    matcher = compile_nutrition_matcher(tuple(nutritions))
+    nutrition_objs = []
+    for obj in valid_objs:
+        text = obj.get("texts", [{}])[0].get("text", "")
+        if search_nutrition_keyword(matcher, text) is not None:
+            nutrition_objs.append(obj)
+
+    row_index = build_row_index(valid_objs, threshold)
+
+    extracted_nutrition = []
+    for obj in nutrition_objs:
+        nutrition = obj["texts"][0]["text"]
+        extracted_vals = [
+            val
+            for val in lookup_row(row_index, obj.get("y", 0))
+            if val != nutrition  # handle case where the value is the same as the nutrition
+        ]
+        extracted_nutrition.append({"nutrition": nutrition, "values": extracted_vals})
+
+    return extracted_nutrition
+
+
+def find_nutrition_keyword(text, nutritions):
+    """
+    Finds which nutrition keyword is contained in the text, ignoring case and spaces.
+
+    Args:
+        text (str): The text of an object from the EyePop response.
+        nutritions (list): Keywords representing the nutrition to look for.
+
+    Returns:
+        str or None: The matched keyword, or None if the text contains no keyword.
+    """
+    return search_nutrition_keyword(compile_nutrition_matcher(tuple(nutritions)), text)
+
+
+def search_nutrition_keyword(matcher, text):
+    """
+    Same as `find_nutrition_keyword` with the matcher compiled beforehand, for the loops over
+    every object, which would otherwise look the keyword set up in the cache for each text.
+
+    Args:
+        matcher (re.Pattern): The keywords compiled by `compile_nutrition_matcher`.
+        text (str): The text of an object from the EyePop response.
+    """
+    match = matcher.search(text.lower().replace(" ", ""))
+    return match.group() if match else None
+
+
+@lru_cache(maxsize=32)
+def compile_nutrition_matcher(nutritions):
+    """
+    Compiles the nutrition keywords into a single regex, factored as a trie so each position
+    of a text only tries the keywords starting with its character: the cost per text stays
+    flat as the vocabulary grows, instead of trying every keyword in turn. Cached per keyword set.
+
+    Args:
+        nutritions (tuple): Keywords representing the nutrition to look for.
+
+    Returns:
+        re.Pattern: A pattern matching any of the keywords, preferring the longest one.
+    """
+    if not nutritions:
+        return re.compile(r"(?!)")  # never matches, same as any() over no keywords
+    trie = {}
+    for nutr in nutritions:
+        node = trie
+        for char in nutr:
+            node = node.setdefault(char, {})
+        node[""] = {}  # a keyword ends here
+    return re.compile(_trie_pattern(trie))
+
+
+def _trie_pattern(node):
+    branches = [re.escape(char) + _trie_pattern(child) for char, child in sorted(node.items()) if char]
+    if not branches:
+        return ""
+    pattern = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+    # the longer keywords are tried first, so e.g. 'carbohydrate' is reported instead of 'carb'
+    if "" in node:
+        return pattern + "?" if len(branches) == 1 and len(branches[0]) == 1 else f"(?:{pattern})?"
+    return pattern
+
+
+def build_row_index(response_obj, threshold):
+    """
+    Builds an index of the objects sorted by their 'y' value so the objects on the same row
+    as a given 'y' can be found with a binary search instead of scanning every object.
+
+    Args:
+        response_obj (list or ColumnarResponse): List of objects containing text, 'x' and 'y' value information.
+        threshold (int or float): Threshold for proximity in 'y' values.
+
+    Returns:
+        dict: The row index, to be queried with `lookup_row`.
+    """
+    # keep the original position so ties on 'x' are ordered like the response
+    if is_columnar(response_obj):
+        entries = sorted(
+            zip(response_obj.y.tolist(), response_obj.x.tolist(), range(len(response_obj)), response_obj.text_list())
+        )
+    else:
+        entries = sorted(
+            (obj.get("y", 0), obj.get("x", 0), pos, obj.get("texts", [{}])[0].get("text", ""))
+            for pos, obj in enumerate(response_obj)
+        )
+    return {
+        # the bounds of the window each object accepts, both sorted in the same order as 'y'
+        "lower": [entry[0] - threshold for entry in entries],
+        "upper": [entry[0] + threshold for entry in entries],
+        "entries": entries,
+    }
+
+
+def lookup_row(row_index, y):
+    """
+    Gets the text values of the objects within the threshold of 'y', sorted by their 'x' value.
+
+    Args:
+        row_index (dict): Index built by `build_row_index`.
+        y (int or float): The 'y' value of the row to look up.
+
+    Returns:
+        list: The text values on the row, ordered left to right.
+    """
+    return [entry[3] for entry in row_entries(row_index, y)]
+
+
+def row_entries(row_index, y):
+    """
+    Gets the index entries, as ('y', 'x', position in the response, text) tuples, of the objects
+    within the threshold of 'y', sorted by their 'x' value.
+    """
+    # an object is on the row when obj['y'] - threshold <= y <= obj['y'] + threshold
+    start = bisect_left(row_index["upper"], y)
+    end = bisect_right(row_index["lower"], y)
+    return sorted(row_index["entries"][start:end], key=lambda entry: (entry[1], entry[2]))
+
+
+class IncrementalParser:
+    """
+    Keeps a response preprocessed so that moving the confidence threshold only recomputes the
+    nutrition rows containing objects whose confidence lies between the old and new threshold,
+    instead of parsing the whole response again.
+
+    `nutrition_values(confidence_threshold)` gives the same result as
+    `get_nutrition_values(response, nutritions, threshold, confidence_threshold)`.
+    """
+
+    def __init__(self, response, nutritions, threshold):
+        with METRICS.timer("parse_index"):
+            self._build(response, nutritions, threshold)
+
+    def _build(self, response, nutritions, threshold):
+        self.response = response
+        if is_columnar(response):
+            response_obj = response
+            self.confidences = response.confidence.tolist()
+            texts = response.text_list()
+            ys = response.y.tolist()
+        else:
+            response_obj = response.get("objects", [])
+            self.confidences = [obj.get("confidence", 0) for obj in response_obj]
+            texts = [obj.get("texts", [{}])[0].get("text", "") for obj in response_obj]
+            ys = [obj.get("y", 0) for obj in response_obj]
+        # objects ordered by confidence, so the ones crossing the threshold are a slice
+        self.by_confidence = sorted(range(len(texts)), key=self.confidences.__getitem__)
+        self.sorted_confidences = [self.confidences[pos] for pos in self.by_confidence]
+
+        # every nutrition row, whatever its confidence, with all the candidates on that row
+        row_index = build_row_index(response_obj, threshold)
+        matcher = compile_nutrition_matcher(tuple(nutritions))
+        self.rows = []
+        self.rows_by_pos = {}  # position of an object -> rows it is a candidate value of
+        for pos, nutrition in enumerate(texts):
+            if search_nutrition_keyword(matcher, nutrition) is None:
+                continue
+            candidates = [
+                (entry[2], entry[3])
+                for entry in row_entries(row_index, ys[pos])
+                if entry[3] != nutrition  # handle case where the value is the same as the nutrition
+            ]
+            for candidate_pos, _ in candidates:
+                self.rows_by_pos.setdefault(candidate_pos, []).append(len(self.rows))
+            self.rows.append({"pos": pos, "nutrition": nutrition, "candidates": candidates, "json": None})
+
+        self.confidence_threshold = None
+
+    def nutrition_values(self, confidence_threshold):
+        """
+        Gets the nutritional information at the given confidence threshold.
+
+        Args:
+            confidence_threshold (float): Minimum confidence level for valid objects.
+
+        Returns:
+            dict: A dictionary with the nutritional information in a JSON format.
+        """
+        with METRICS.timer("parse_incremental"):
+            return self._nutrition_values(confidence_threshold)
+
+    def _nutrition_values(self, confidence_threshold):
+        if self.confidence_threshold is None:
+            stale_rows = range(len(self.rows))
+        else:
+            low, high = sorted((self.confidence_threshold, confidence_threshold))
+            start = bisect_left(self.sorted_confidences, low)
+            end = bisect_left(self.sorted_confidences, high)
+            stale_rows = {
+                row
+                for pos in self.by_confidence[start:end]
+                for row in self.rows_by_pos.get(pos, [])
+            }
+        self.confidence_threshold = confidence_threshold
+
+        for row in stale_rows:
+            row = self.rows[row]
+            values = [
+                text
+                for pos, text in row["candidates"]
+                if self.confidences[pos] >= confidence_threshold
+            ]
+            row["json"] = nutrition_values_to_json([{"nutrition": row["nutrition"], "values": values}])
+        METRICS.observe("rows_reparsed", len(stale_rows))
+
+        # rows are independent, so merging them in response order matches nutrition_values_to_json
+        nutrition_dict = {}
+        for row in self.rows:
+            if self.confidences[row["pos"]] >= confidence_threshold:
+                nutrition_dict.update(row["json"])
+        return nutrition_dict
+
+
+def nutrition_values_to_json(extracted_nutrition):
+    """
+    Converts the extracted nutritional information to a JSON format.
+
+    Args:
+        extracted_nutrition (list): List of dictionaries containing 'nutrition' and 'values'.
+
+    Returns:
+        dict: Nutritional information in a structured JSON format.
+    """
+    parsed_nutrition = []
+
+    for nutr in extracted_nutrition:
+        # Clean and format the nutritional values to ensure we get strings of 10mg instead of ['10', 'mg']
+        # We do this as EyePop can sometimes get texts in separate objects
+        nutrition, values = nutr["nutrition"], clean_nutrition_values(nutr["values"])
+        
+        parsed_vals = [] 
+        for val in values:
+            # Use regex to check if the value is alphanumeric, 
+            # if it is, it is part of the nutrition name
+            # Otherwise, it is a value
+            if _WORD.fullmatch(val):
+                # Check if the value is part of the nutrition name
+                # E.g 'Total Fat' from ['Total', 'Fat']
+                nutrition = (
+                    f"{nutrition} {val}"
+                    if "serving" in nutrition.lower()
+                    else f"{val} {nutrition}"
+                )
+            else:
+                parsed_vals.append(val)
+
+        parsed_nutrition.append({"nutrition": nutrition, "values": parsed_vals})
+
+    nutrition_dict = {}
+    for nutr in parsed_nutrition:
+        # Compose the nutrition dictionary/json objec deliverable
+        nutrition, values = nutr["nutrition"], [
+            val for val in nutr["values"] if "%" not in val
+        ] # Ignore percentage values
+        if "serving" in nutrition.lower():
+            nutrition = "serving"
+
+        if len(values) == 1:
+            # If there is only one value, add it directly to the dictionary 
+            # E.g 'Calories': '100' (given that the label only has one value)
+            # Or, the CV tool did not extract the other values
+            nutrition_dict[nutrition.capitalize()] = values[0]
+        else:
+            # If there are multiple values, add them with an index
+            for i, val in enumerate(values):
+                nutrition_dict[f"{nutrition.capitalize()}_{i}"] = val
+
+    return nutrition_dict
+
+
+def clean_nutrition_values(values):
+    """
+    Cleans the nutritional values extracted from the EyePop response.
+    """
+    clean_vals = []
+    i = 0
+    while i < len(values):
+        if i + 1 < len(values) and values[i + 1] in units:
+            clean_vals.append(f"{values[i]}{values[i + 1]}")
+            i += 2
+        else:
+            clean_vals.append(values[i])
+            i += 1
+
+    return clean_vals
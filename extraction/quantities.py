@@ -0,0 +1,165 @@
+"""
+Typed nutrition values: tokens such as '15mg', '1,200 mg', 'Omg' (an OCR'd 0) or a number
+followed by a separate unit token become `Quantity(amount, unit)` records that can be converted
+between units, instead of strings every consumer has to parse again. Tokens that are not an
+amount (OCR junk such as 'D1mg', or words) give None.
+
+The grammar is compiled once and tokens are memoized in a bounded LRU cache, labels repeat the
+same few tokens ('0g', '0mg', '5%') so normalizing many stored results mostly hits the cache.
+"""
+import os
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+# variables
+QUANTITY_CACHE_SIZE = int(os.getenv("QUANTITY_CACHE_SIZE", 65536))
+
+# unit -> (dimension, size in the base unit of the dimension: grams, kcal or percent)
+UNITS = {
+    "": ("count", 1.0),
+    "mcg": ("mass", 1e-6),
+    "mg": ("mass", 1e-3),
+    "g": ("mass", 1.0),
+    "kg": ("mass", 1e3),
+    "oz": ("mass", 28.349523125),
+    "lb": ("mass", 453.59237),
+    "kcal": ("energy", 1.0),
+    "kj": ("energy", 1 / 4.184),
+    "iu": ("iu", 1.0),
+    "%": ("percent", 1.0),
+}
+# spellings of the units on labels, in lower case
+UNIT_ALIASES = {
+    **{unit: unit for unit in UNITS if unit},
+    "µg": "mcg",
+    "ug": "mcg",
+    "lbs": "lb",
+    "cal": "kcal",  # 'Calories' on a label are kilocalories
+    "calories": "kcal",
+}
+
+_UNIT = "|".join(sorted((re.escape(alias) for alias in UNIT_ALIASES), key=len, reverse=True))
+# an amount, where OCR may have read 0 as O and 1 as l or I, then an optional unit. A bound such
+# as '<1g' is not an amount, storing it as 1g would turn it into an equality
+_TOKEN = re.compile(rf"\s*(?P<amount>[\dOIl][\dOIl.,]*|\.\d+)\s*(?P<unit>(?i:{_UNIT}))?\s*")
+# a thousands separator is a comma before exactly 3 digits, any other comma is a decimal point
+_NUMBER = re.compile(r"(?P<int>\d{1,3}(?:,\d{3})+|\d*)(?:[.,](?P<frac>\d+))?")
+_OCR_DIGITS = str.maketrans("OIl", "011")
+
+
+class Quantity(namedtuple("Quantity", ["amount", "unit"])):
+    """
+    An amount with its (canonical, lower case) unit, '' for a count such as calories.
+    """
+
+    __slots__ = ()
+
+    @property
+    def dimension(self):
+        """
+        'mass', 'energy', 'percent', 'iu' or 'count'.
+        """
+        return UNITS[self.unit][0]
+
+    @property
+    def grams(self):
+        """
+        The amount in grams, None if the unit is not a mass.
+        """
+        dimension, size = UNITS[self.unit]
+        return self.amount * size if dimension == "mass" else None
+
+    def to(self, unit):
+        """
+        Converts to another unit of the same dimension, e.g. `Quantity(430, 'mg').to('g')`.
+        """
+        unit = UNIT_ALIASES.get(unit.lower(), unit.lower())
+        dimension, size = UNITS[self.unit]
+        if UNITS.get(unit, (None,))[0] != dimension:
+            raise ValueError(f"cannot convert {self.unit or 'a count'} to {unit or 'a count'}")
+        return Quantity(self.amount * size / UNITS[unit][1], unit)
+
+    def __str__(self):
+        return f"{self.amount:g}{self.unit}"
+
+
+def parse_unit(token):
+    """
+    Gets the canonical unit of a token that is only a unit (e.g. 'MG'), or None.
+    """
+    return UNIT_ALIASES.get(token.strip().lower()) if isinstance(token, str) else None
+
+
+def parse_quantity(token, unit=None):
+    """
+    Parses a token such as '430mg', or a number with its unit given apart.
+    Memoized, `quantity_cache_info()` tells how often tokens repeat.
+
+    Returns:
+        Quantity: The amount and unit, or None if the token is not an amount.
+    """
+    if not isinstance(token, (str, int, float)):
+        token = str(token)  # e.g. a list in an imported record, which the cache cannot hash
+    return _parse_quantity(token, unit if unit is None else str(unit))
+
+
+def quantity_cache_info():
+    """
+    Gets the hits, misses and size of the cache of `parse_quantity`.
+    """
+    return _parse_quantity.cache_info()
+
+
+@lru_cache(maxsize=QUANTITY_CACHE_SIZE)
+def _parse_quantity(token, unit):
+    if isinstance(token, (int, float)):
+        amount = float(token)
+    else:
+        match = _TOKEN.fullmatch(token)
+        if match is None:
+            return None
+        if not any(c.isdigit() for c in match.group("amount")) and not (match.group("amount") == "O" and match.group("unit")):
+            return None  # 'lg' or 'Ig' are words, only 'Omg' (0mg) is read without a real digit
+        number = _NUMBER.fullmatch(match.group("amount").translate(_OCR_DIGITS))
+        if number is None or not (number.group("int") or number.group("frac")):
+            return None
+        amount = float(f"{number.group('int').replace(',', '') or 0}.{number.group('frac') or 0}")
+        unit = match.group("unit") or unit
+    unit = UNIT_ALIASES.get(unit.lower()) if unit else ""
+    return None if unit is None else Quantity(amount, unit)
+
+
+def tokenize_values(values):
+    """
+    Typed counterpart of `clean_nutrition_values`: turns the value tokens of a nutrition into
+    quantities, joining an amount with the unit that follows it as a separate token
+    (e.g. ['10', 'mg', '5%'] gives [Quantity(10.0, 'mg'), Quantity(5.0, '%')]). Tokens that are
+    not amounts are skipped.
+    """
+    quantities = []
+    i = 0
+    while i < len(values):
+        quantity = parse_quantity(values[i])
+        if quantity is not None and quantity.unit == "" and i + 1 < len(values):
+            unit = parse_unit(values[i + 1])
+            if unit is not None:
+                quantity = Quantity(quantity.amount, unit)
+                i += 1
+        if quantity is not None:
+            quantities.append(quantity)
+        i += 1
+    return quantities
+
+
+def normalize_nutrition(nutrition):
+    """
+    Types the output of `get_nutrition_values`, e.g. {'Sodium_0': '430mg'} gives
+    {'Sodium_0': Quantity(430.0, 'mg')}. Values that are not amounts are left out.
+    """
+    quantities = {}
+    for key, value in nutrition.items():
+        quantity = parse_quantity(value)
+        if quantity is not None:
+            quantities[key] = quantity
+    return quantities
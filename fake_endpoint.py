@@ -0,0 +1,165 @@
+"""
+A local stand-in for the EyePop endpoint, with the same `upload(...).predict()` surface as
+`EyePopSdk.endpoint()`, that replays recorded responses with configurable latency and errors.
+Used to load-test and exercise the pipeline without calling the real service.
+
+Usage:
+    pool = EndpointPool(factory=fake_endpoint_factory(predict_latency=lognormal(0.8, 0.4), error_rate=0.02))
+"""
+import copy
+import hashlib
+import json
+import math
+import os
+import random
+import threading
+import time
+
+# variables
+SAMPLE_RESPONSES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "sample_responses.jsonl")
+
+
+class FakeEndpointError(Exception):
+    """
+    Raised by the fake endpoint to simulate a failed request.
+    """
+
+
+def constant(seconds):
+    """
+    Latency distribution that always takes `seconds`.
+    """
+    return lambda rng: seconds
+
+
+def uniform(low, high):
+    """
+    Latency distribution uniform between `low` and `high` seconds.
+    """
+    return lambda rng: rng.uniform(low, high)
+
+
+def lognormal(median, sigma):
+    """
+    Latency distribution with the given median (in seconds) and a long right tail, the usual
+    shape of network service latencies.
+    """
+    return lambda rng: rng.lognormvariate(math.log(median), sigma)
+
+
+def load_responses(path=SAMPLE_RESPONSES):
+    """
+    Loads recorded EyePop responses from a JSON file (one response or a list of them) or a JSON
+    lines file. Records may be the raw response or wrap it under a 'response' key.
+
+    Args:
+        path (str): Path of the recorded responses.
+
+    Returns:
+        list: The responses, each a dictionary with an 'objects' list.
+    """
+    with open(path) as f:
+        if path.endswith(".jsonl"):
+            records = [json.loads(line) for line in f if line.strip()]
+        else:
+            records = json.load(f)
+            records = records if isinstance(records, list) else [records]
+    responses = [record.get("response", record) for record in records]
+    return [response for response in responses if "objects" in response]
+
+
+class FakeJob:
+    """
+    The result of an upload, `predict()` waits for the simulated inference and returns the response.
+    """
+
+    def __init__(self, endpoint, content):
+        self.endpoint = endpoint
+        self.content = content
+
+    def predict(self):
+        return self.endpoint._predict(self.content)
+
+
+class FakeEndpoint:
+    """
+    Stand-in for the endpoint returned by `EyePopSdk.endpoint()`.
+
+    The same image content always gets the same recorded response, so caches behave like with
+    the real service.
+    """
+
+    def __init__(
+        self,
+        responses=None,
+        connect_latency=constant(0.0),
+        upload_latency=constant(0.0),
+        predict_latency=constant(0.0),
+        error_rate=0.0,
+        seed=None,
+    ):
+        """
+        Args:
+            responses (list): Recorded responses to replay, the bundled samples by default.
+            connect_latency (callable): Distribution of the time to connect, see `lognormal`.
+            upload_latency (callable): Distribution of the time to upload an image.
+            predict_latency (callable): Distribution of the time to get a prediction.
+            error_rate (float): Probability that a prediction raises `FakeEndpointError`.
+            seed (int): Seed of the random latencies and errors.
+        """
+        self.responses = responses if responses is not None else load_responses()
+        self.connect_latency = connect_latency
+        self.upload_latency = upload_latency
+        self.predict_latency = predict_latency
+        self.error_rate = error_rate
+        self.predictions = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        time.sleep(self._sample(self.connect_latency))
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def upload(self, location):
+        with open(location, "rb") as f:
+            return self.upload_stream(f, None)
+
+    def upload_stream(self, stream, mime_type):
+        content = stream.read()
+        time.sleep(self._sample(self.upload_latency))
+        return FakeJob(self, content)
+
+    def _predict(self, content):
+        time.sleep(self._sample(self.predict_latency))
+        with self._lock:
+            failed = self._rng.random() < self.error_rate
+            self.predictions += 1
+        if failed:
+            raise FakeEndpointError("simulated EyePop failure")
+        # pick the response from the content so repeated images get the same prediction
+        index = int.from_bytes(hashlib.sha256(content).digest()[:4], "big") % len(self.responses)
+        # a copy, so a caller modifying its response does not change the next predictions
+        return copy.deepcopy(self.responses[index])
+
+    def _sample(self, distribution):
+        with self._lock:
+            return max(0.0, distribution(self._rng))
+
+
+def fake_endpoint_factory(**kwargs):
+    """
+    Creates a factory of fake endpoints sharing the same responses, to pass to `EndpointPool`.
+
+    Args:
+        **kwargs: Arguments of `FakeEndpoint`.
+
+    Returns:
+        callable: Creates a new `FakeEndpoint` on each call.
+    """
+    kwargs.setdefault("responses", load_responses())
+    seed = kwargs.pop("seed", None)
+    seeds = random.Random(seed)
+    return lambda: FakeEndpoint(seed=seeds.random(), **kwargs)
@@ -1,8 +1,14 @@
 # pip install eyepop pandas python-dotenv
-from eyepop import EyePopSdk
+import os
+import sys
 from dotenv import load_dotenv
 from utils import get_nutrition_values
 
+# Share the prediction cache with the dashboard at the root of the repo
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from endpoint_pool import EndpointPool
+from prediction_cache import PredictionCache
+
 # Define the possible nutrition labels to extract
 NUTRITIONS = [
     'protein', 'fat', 'calories', 'sugar', 'sodium', 'fiber', 'carbohydrate', 'cholesterol', 'carbs'
@@ -16,8 +22,13 @@ filepath = 'images/label 2.jpg'
 # Get EyePop Api key and id
 load_dotenv() # Load the environment variables
 
-# Initialize the EyePop SDK
-with EyePopSdk.endpoint() as endpoint:
-    response = endpoint.upload(filepath).predict()
+# Initialize the EyePop SDK, the connection is only opened on a cache miss
+pool = EndpointPool(size=1)
+
+# Only call EyePop if this image has not been seen before
+with open(filepath, 'rb') as f:
+    image_bytes = f.read()
+response = PredictionCache().get_or_predict(image_bytes, lambda: pool.predict(filepath), os.getenv('EYEPOP_POP_ID'))
+pool.close()
     
 print(get_nutrition_values(response, NUTRITIONS, THRESHOLD))
\ No newline at end of file
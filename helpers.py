@@ -1,179 +1,143 @@
-import re
-from eyepop import EyePopSdk
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import pandas as pd
 import streamlit as st
+from endpoint_pool import EndpointPool
+from extraction import NUTRITIONS, THRESHOLD, IncrementalParser
+from extraction.columnar import ColumnarResponse
+from extraction.metrics import METRICS
+from prediction_cache import PredictionCache
+from result_store import ResultStore
+from preprocess import predict_downscaled, settings_id
+from resilience import ResilientPredictor
 
-# variables
-units = {'mg', 'g', '%', 'kg', 'lb', 'oz'}
 
-NUTRITIONS = [
-    'protein', 'fat', 'calories', 'sugar', 'sodium', 'fiber', 'carbohydrate', 'cholesterol', 'carbs'
-]
-THRESHOLD = 10
+@st.cache_resource
+def get_prediction_cache():
+    # one disk cache shared by every session of the process
+    return PredictionCache()
+
+
+@st.cache_resource
+def get_endpoint_pool():
+    # warm EyePop connections shared by every session of the process
+    return EndpointPool()
+
+
+@st.cache_resource
+def get_predictor():
+    # latency budget, retries, hedging and circuit breaker around the shared pool
+    return ResilientPredictor(get_endpoint_pool())
+
+
+@st.cache_resource
+def get_result_store():
+    # results saved from every session of the process go to the same store
+    return ResultStore()
+
 
 @st.cache_data
 def call_eye_pop(uploaded_file):
     if st.session_state.uploaded_file is None and uploaded_file != st.session_state.uploaded_file:
         return
-    # save the uploaded file to /assests/uploads/uploaded_image.png
-    filepath = 'assets/uploads/uploaded_image.png'
-    with open(filepath, 'wb') as f:
-        f.write(st.session_state.uploaded_file.getvalue())
-    
-    with st.spinner("Processing..."):
-        # send file to eyepop api to get the result
-        with EyePopSdk.endpoint() as endpoint:
-            response = endpoint.upload(filepath).predict()
-            
-    return response
+    image_bytes = st.session_state.uploaded_file.getvalue()
 
-def update_state_vars(response):
-    st.session_state.nutrition_data = get_nutrition_values(response, NUTRITIONS, THRESHOLD, st.session_state.confidence_threshold)
-    st.session_state.raw_response = response
-    
-    
-def get_nutrition_values(response, nutritions, threshold, confidence_threshold=0.5):
-    """
-    Extracts nutritional information from the response based on the given nutrition strings and threshold.
+    def predict():
+        # only traced on a miss, a rerun served from the cache is not a request to EyePop
+        with st.spinner("Processing..."), METRICS.request(st.session_state.uploaded_file.name):
+            # send a downscaled copy straight from memory to eyepop api to get the result
+            return predict_downscaled(get_predictor().predict_bytes, image_bytes)
 
-    Args:
-        response (dict): A dictionary containing the response object from the EyePop API.
-        nutritions (list): A list of strings representing the nutrition keywords to look for.
-        threshold (int or float): The threshold value to determine proximity in 'y' values.
-        confidence_threshold (float): Minimum confidence level for valid objects.
-
-    Returns:
-        dict: A dictionary with the nutritional information in a JSON format.
-    """
-    response_obj = response.get("objects", [])
-    extracted_nutrition = parse_result(
-        response_obj, nutritions, threshold, confidence_threshold
+    # repeated labels are served from the disk cache without calling EyePop
+    response = get_prediction_cache().get_or_predict(
+        image_bytes, predict, os.getenv("EYEPOP_POP_ID"), settings_id()
     )
-    return nutrition_values_to_json(extracted_nutrition)
+    # the session only keeps the compact columnar form of the response
+    return ColumnarResponse.from_response(response) if response is not None else None
 
 
-def parse_result(response_obj, nutritions, threshold, confidence_threshold=0.5):
+def predict_files(uploaded_files):
     """
-    Parses the response object to extract nutritional information based on given nutrition strings and a threshold.
+    Gets the predictions of several uploaded images concurrently, one per pooled endpoint,
+    yielding each one as soon as it lands so its result can be shown before the rest finish.
 
     Args:
-        response_obj (list): List of objects containing text and 'y' value information.
-        nutritions (list): Keywords representing the nutrition to look for.
-        threshold (int or float): Threshold for proximity in 'y' values.
-        confidence_threshold (float): Minimum confidence level for valid objects.
+        uploaded_files (list): The files from a `st.file_uploader` with `accept_multiple_files`.
 
-    Returns:
-        list: Extracted nutritional information as a list of dictionaries.
+    Yields:
+        tuple: The uploaded file, its columnar response (None if it failed) and the exception (None if it succeeded).
     """
-    # get all the objects that contain nutrition information
-    nutrition_objs = []
-    for obj in response_obj:
-        text = obj.get("texts", [{}])[0].get("text", "").lower().replace(" ", "")
-        if (
-            any([
-                    nutr in text
-                    for nutr in nutritions
-                ])
-            and obj.get("confidence", 0) >= confidence_threshold
-        ):
-            nutrition_objs.append(obj)
-
-    extracted_nutrition = []
-    for obj in nutrition_objs:
-        y = obj.get("y", 0)
-        extracted_vals = []
-        for comparison_obj in response_obj:
-            if (  # check if the object is within the threshold
-                comparison_obj.get("confidence", 0) >= confidence_threshold
-                and 
-                comparison_obj["y"] - threshold <= y <= comparison_obj["y"] + threshold
-            ):
-                val = comparison_obj.get("texts", [{}])[0].get("text", "")  # get the text value
-                val_x = comparison_obj["x"]  # get the x value
-                if (
-                    val == obj["texts"][0]["text"]
-                ):  # handle case where the value is the same as the nutrition
-                    continue
-                extracted_vals.append((val_x, val))  # add to the extracted values
-
-        # Sort the extracted values by x value and return only the text value
-        extracted_vals = [val[1] for val in sorted(extracted_vals, key=lambda x: x[0])]
-        extracted_nutrition.append(
-            {"nutrition": obj["texts"][0]["text"], "values": extracted_vals}
-        )
-
-    return extracted_nutrition
-
-
-def nutrition_values_to_json(extracted_nutrition):
+    # the cache and the pool are resolved on the script thread, the workers only use them
+    cache, predictor = get_prediction_cache(), get_predictor()
+    pop_id, variant = os.getenv("EYEPOP_POP_ID"), settings_id()
+
+    def predict(name, image_bytes):
+        def miss():
+            with METRICS.request(name):
+                return predict_downscaled(predictor.predict_bytes, image_bytes)
+
+        response = cache.get_or_predict(image_bytes, miss, pop_id, variant)
+        return ColumnarResponse.from_response(response) if response is not None else None
+
+    with ThreadPoolExecutor(max_workers=predictor.pool.size) as executor:
+        futures = {
+            executor.submit(predict, uploaded_file.name, uploaded_file.getvalue()): uploaded_file
+            for uploaded_file in uploaded_files
+        }
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except Exception as e:
+                yield futures[future], None, e
+
+
+@st.fragment
+def raw_response_browser(response):
     """
-    Converts the extracted nutritional information to a JSON format.
+    Shows the objects of the response one page at a time, filtered by confidence and text.
+    They are rebuilt from the columns, so only their id, confidence, box and text are shown.
+    As a fragment, paging and filtering only rerun this function, and only the objects of the
+    current page are converted and sent to the browser.
 
     Args:
-        extracted_nutrition (list): List of dictionaries containing 'nutrition' and 'values'.
-
-    Returns:
-        dict: Nutritional information in a structured JSON format.
+        response (ColumnarResponse): The response to browse.
     """
-    parsed_nutrition = []
-
-    for nutr in extracted_nutrition:
-        # Clean and format the nutritional values to ensure we get strings of 10mg instead of ['10', 'mg']
-        # We do this as EyePop can sometimes get texts in separate objects
-        nutrition, values = nutr["nutrition"], clean_nutrition_values(nutr["values"])
-        
-        parsed_vals = [] 
-        for val in values:
-            # Use regex to check if the value is alphanumeric, 
-            # if it is, it is part of the nutrition name
-            # Otherwise, it is a value
-            if re.sub(r"[^A-Za-z0-9]", "", val).isalpha():
-                # Check if the value is part of the nutrition name
-                # E.g 'Total Fat' from ['Total', 'Fat']
-                nutrition = (
-                    f"{nutrition} {val}"
-                    if "serving" in nutrition.lower()
-                    else f"{val} {nutrition}"
-                )
-            else:
-                parsed_vals.append(val)
-
-        parsed_nutrition.append({"nutrition": nutrition, "values": parsed_vals})
-
-    nutrition_dict = {}
-    for nutr in parsed_nutrition:
-        # Compose the nutrition dictionary/json objec deliverable
-        nutrition, values = nutr["nutrition"], [
-            val for val in nutr["values"] if "%" not in val
-        ] # Ignore percentage values
-        if "serving" in nutrition.lower():
-            nutrition = "serving"
-
-        if len(values) == 1:
-            # If there is only one value, add it directly to the dictionary 
-            # E.g 'Calories': '100' (given that the label only has one value)
-            # Or, the CV tool did not extract the other values
-            nutrition_dict[nutrition.capitalize()] = values[0]
-        else:
-            # If there are multiple values, add them with an index
-            for i, val in enumerate(values):
-                nutrition_dict[f"{nutrition.capitalize()}_{i}"] = val
-
-    return nutrition_dict
-
-
-def clean_nutrition_values(values):
-    """
-    Cleans the nutritional values extracted from the EyePop response.
-    """
-    units = {"mg", "g", "%", "kg", "lb", "oz"}
-    clean_vals = []
-    i = 0
-    while i < len(values):
-        if i + 1 < len(values) and values[i + 1] in units:
-            clean_vals.append(f"{values[i]}{values[i + 1]}")
-            i += 2
-        else:
-            clean_vals.append(values[i])
-            i += 1
-
-    return clean_vals
+    col1, col2, col3 = st.columns([2, 2, 1])
+    min_confidence = col1.slider("Minimum confidence", 0.0, 1.0, 0.0, key="raw_min_confidence")
+    text = col2.text_input("Text contains", key="raw_text")
+    page_size = col3.selectbox("Per page", [25, 50, 100, 250], key="raw_page_size")
+
+    positions = response.find(min_confidence, text)
+    pages = max(1, -(-len(positions) // page_size))
+    # the filters may have left fewer pages than the one shown
+    st.session_state.raw_page = min(st.session_state.get("raw_page", 1), pages)
+    page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, step=1, key="raw_page")
+    page_positions = positions[(page - 1) * page_size:page * page_size]
+    st.caption(
+        f"{len(positions)} of {len(response)} objects match. Rebuilt from the parsed response: only the id, "
+        "confidence, box and text of each object are kept, not its category, class label or text confidence."
+    )
+
+    if st.toggle("As JSON", key="raw_as_json"):
+        st.json({**response.meta, "objects": response.objects(page_positions.tolist())})
+    else:
+        st.dataframe(
+            pd.DataFrame({
+                "id": response.ids[page_positions],
+                "text": [response.texts[text_id] for text_id in response.text_ids[page_positions].tolist()],
+                "confidence": response.confidence[page_positions],
+                "x": response.x[page_positions],
+                "y": response.y[page_positions],
+                "width": response.width[page_positions],
+                "height": response.height[page_positions],
+            }),
+            hide_index=True,
+        )
+
+
+def update_state_vars(response):
+    # comparing against the previous response is much cheaper than parsing it again
+    if st.session_state.get("parser") is None or st.session_state.parser.response != response:
+        st.session_state.parser = IncrementalParser(response or {}, NUTRITIONS, THRESHOLD)
+    st.session_state.nutrition_data = st.session_state.parser.nutrition_values(st.session_state.confidence_threshold)
+    st.session_state.raw_response = response
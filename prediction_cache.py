@@ -0,0 +1,219 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from extraction.metrics import METRICS
+from single_flight import SingleFlight
+
+# variables
+CACHE_PATH = os.getenv(
+    "PREDICTION_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "predictions.sqlite3"),
+)
+CACHE_MAX_ENTRIES = int(os.getenv("PREDICTION_CACHE_MAX_ENTRIES", 10_000))
+CACHE_MAX_BYTES = int(os.getenv("PREDICTION_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+CACHE_TTL = float(os.getenv("PREDICTION_CACHE_TTL", 30 * 24 * 60 * 60))  # seconds
+# inserts between two recounts of the cache, other processes sharing the file change its size too
+CACHE_RECOUNT_EVERY = int(os.getenv("PREDICTION_CACHE_RECOUNT_EVERY", 1000))
+
+
+def image_key(image_bytes, pop_id=None, variant=None):
+    """
+    Computes the cache key of an image from its content, so the same label uploaded
+    under different file names maps to the same prediction.
+
+    Args:
+        image_bytes (bytes): The raw bytes of the image.
+        pop_id (str): Optional EyePop pop id, so different models do not share predictions.
+        variant (str): Optional id of how the image was preprocessed before upload.
+
+    Returns:
+        str: The hex digest identifying the image (and pop).
+    """
+    digest = hashlib.sha256(image_bytes)
+    if pop_id:
+        digest.update(b"\0" + pop_id.encode())
+    if variant:
+        digest.update(b"\1" + variant.encode())
+    return digest.hexdigest()
+
+
+class PredictionCache:
+    """
+    Disk-backed cache of EyePop responses keyed by `image_key`, bounded by number of entries,
+    total size and age. The least recently used entries are evicted first.
+    """
+
+    def __init__(
+        self,
+        path=CACHE_PATH,
+        max_entries=CACHE_MAX_ENTRIES,
+        max_bytes=CACHE_MAX_BYTES,
+        ttl=CACHE_TTL,
+        clock=time.time,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # misses for an image that is already being predicted wait for that prediction
+        self._in_flight = SingleFlight()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # shared between the Streamlit sessions of the process, access is serialized by the lock
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS predictions (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS predictions_last_access ON predictions (last_access)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS predictions_created_at ON predictions (created_at)")
+        # running totals, so an insert does not scan the whole table to check the bounds
+        self._entries, self._bytes = self._count()
+        self._inserts = 0
+
+    def get(self, key):
+        """
+        Gets the cached response for the key, or None if it is missing or expired.
+        """
+        response = self._lookup(key)
+        if response is None:
+            with self._lock:
+                self.misses += 1
+            METRICS.increment("cache_misses")
+            METRICS.annotate("cache", "miss")
+            return None
+        with self._lock:
+            self.hits += 1
+        METRICS.increment("cache_hits")
+        METRICS.annotate("cache", "hit")
+        return response
+
+    def _lookup(self, key):
+        # same as `get` without counting a hit or miss
+        now = self.clock()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM predictions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                return None
+            self._conn.execute("UPDATE predictions SET last_access = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def set(self, key, response):
+        """
+        Stores the response for the key, evicting old entries if the cache is over its bounds.
+        """
+        payload = json.dumps(response)
+        # the size bounds are in bytes, a str counts characters
+        size = len(payload.encode())
+        now = self.clock()
+        with self._lock:
+            replaced = self._conn.execute("SELECT size FROM predictions WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?, ?)", (key, payload, size, now, now)
+            )
+            if replaced is None:
+                self._entries += 1
+                self._bytes += size
+            else:
+                self._bytes += size - replaced[0]
+            self._inserts += 1
+            if self._inserts % CACHE_RECOUNT_EVERY == 0:
+                self._entries, self._bytes = self._count()
+            self._evict(now)
+
+    def get_or_predict(self, image_bytes, predict, pop_id=None, variant=None):
+        """
+        Gets the response of the image from the cache, calling `predict` only on a miss.
+        Concurrent misses for the same image share a single call to `predict`.
+
+        Args:
+            image_bytes (bytes): The raw bytes of the image.
+            predict (callable): Called without arguments to get the response on a miss.
+            pop_id (str): Optional EyePop pop id to include in the key.
+            variant (str): Optional id of the preprocessing settings to include in the key.
+
+        Returns:
+            dict: The (possibly cached) response from the EyePop API.
+        """
+        key = image_key(image_bytes, pop_id, variant)
+        response = self.get(key)
+        if response is None:
+            response = self._in_flight.do(key, lambda: self._predict(key, predict))
+        return response
+
+    def _predict(self, key, predict):
+        # a previous leader may have stored the response between our miss and taking the key
+        response = self._lookup(key)
+        if response is not None:
+            return response
+        response = predict()
+        if response is not None:
+            self.set(key, response)
+        return response
+
+    def stats(self):
+        """
+        Gets the hit/miss counters of this process and the current size of the cache.
+        """
+        with self._lock:
+            entries, total_bytes = self._entries, self._bytes
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "coalesced": self._in_flight.coalesced,
+            "entries": entries,
+            "bytes": total_bytes,
+        }
+
+    def clear(self):
+        """
+        Removes every entry from the cache.
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM predictions")
+            self._entries, self._bytes = 0, 0
+
+    def _count(self):
+        return self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM predictions").fetchone()
+
+    def _evict(self, now):
+        # drop the expired entries (a range of the created_at index, usually empty), then the
+        # least recently used until within bounds
+        expired, expired_bytes = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM predictions WHERE created_at < ?", (now - self.ttl,)
+        ).fetchone()
+        if expired:
+            self._conn.execute("DELETE FROM predictions WHERE created_at < ?", (now - self.ttl,))
+            self._entries -= expired
+            self._bytes -= expired_bytes
+        if self._entries <= self.max_entries and self._bytes <= self.max_bytes:
+            return
+
+        evicted = []
+        for key, size in self._conn.execute("SELECT key, size FROM predictions ORDER BY last_access"):
+            if self._entries <= self.max_entries and self._bytes <= self.max_bytes:
+                break
+            evicted.append((key,))
+            self._entries -= 1
+            self._bytes -= size
+        self._conn.executemany("DELETE FROM predictions WHERE key = ?", evicted)
@@ -0,0 +1,106 @@
+import io
+import os
+from PIL import Image, ImageOps
+from extraction.metrics import METRICS
+
+# variables
+UPLOAD_MAX_DIM = int(os.getenv("UPLOAD_MAX_DIM", 1600))  # 0 to upload at full resolution
+UPLOAD_FORMAT = os.getenv("UPLOAD_FORMAT", "JPEG")  # JPEG or WEBP
+UPLOAD_QUALITY = int(os.getenv("UPLOAD_QUALITY", 85))
+
+MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+
+
+def settings_id(max_dim=UPLOAD_MAX_DIM, image_format=UPLOAD_FORMAT, quality=UPLOAD_QUALITY):
+    """
+    Gets a short string identifying the upload settings, used to keep cached predictions
+    made with different settings apart.
+    """
+    return f"{max_dim}-{image_format.upper()}-{quality}"
+
+
+def downscale_image(image_bytes, max_dim=UPLOAD_MAX_DIM, image_format=UPLOAD_FORMAT, quality=UPLOAD_QUALITY):
+    """
+    Resizes the image so its longest side is at most `max_dim` and re-encodes it, since most of
+    the bytes of a phone photo are not needed to read the text on a label.
+
+    Args:
+        image_bytes (bytes): The raw bytes of the original image.
+        max_dim (int): Maximum width/height of the uploaded image, 0 to keep the original size.
+        image_format (str): Format to re-encode to, 'JPEG' or 'WEBP'.
+        quality (int): Encoder quality from 1 to 100.
+
+    Returns:
+        tuple: The bytes to upload, their mime type, and the (x, y) scale from the original
+        image to the uploaded one, to map the response back with `rescale_response`.
+    """
+    image = Image.open(io.BytesIO(image_bytes))
+    original_format = image.format
+    # apply the EXIF rotation, it is lost when re-encoding
+    image = ImageOps.exif_transpose(image)
+    width, height = image.size
+
+    if max_dim and max(width, height) > max_dim:
+        ratio = max_dim / max(width, height)
+        image = image.resize((max(1, round(width * ratio)), max(1, round(height * ratio))), Image.LANCZOS)
+
+    image_format = image_format.upper()
+    if image_format == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")  # JPEG has no alpha channel
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format, quality=quality)
+    scale = (image.size[0] / width, image.size[1] / height)
+
+    if scale == (1.0, 1.0) and buffer.tell() >= len(image_bytes) and original_format in MIME_TYPES:
+        # re-encoding did not help, upload the original as is
+        return image_bytes, MIME_TYPES[original_format], scale
+    return buffer.getvalue(), MIME_TYPES[image_format], scale
+
+
+def rescale_response(response, scale):
+    """
+    Maps the coordinates of a response for a downscaled image back to the original image,
+    so `THRESHOLD` and everything downstream keep working in the original frame.
+
+    Args:
+        response (dict): The response from the EyePop API for the downscaled image.
+        scale (tuple): The (x, y) scale returned by `downscale_image`.
+
+    Returns:
+        dict: A copy of the response with 'x', 'y', 'width' and 'height' in the original frame.
+    """
+    scale_x, scale_y = scale
+    if response is None or (scale_x == 1 and scale_y == 1):
+        return response
+
+    def rescale(obj):
+        obj = dict(obj)
+        for key, factor in (("x", scale_x), ("width", scale_x), ("y", scale_y), ("height", scale_y)):
+            if key in obj:
+                obj[key] = obj[key] / factor
+        return obj
+
+    response = dict(response)
+    if "source_width" in response:
+        response["source_width"] = round(response["source_width"] / scale_x)
+    if "source_height" in response:
+        response["source_height"] = round(response["source_height"] / scale_y)
+    response["objects"] = [rescale(obj) for obj in response.get("objects", [])]
+    return response
+
+
+def predict_downscaled(predict_bytes, image_bytes, max_dim=UPLOAD_MAX_DIM, image_format=UPLOAD_FORMAT, quality=UPLOAD_QUALITY):
+    """
+    Downscales the image, gets its prediction and maps the response back to the original frame.
+
+    Args:
+        predict_bytes (callable): Called with the bytes to upload and their mime type, e.g. `EndpointPool.predict_bytes`.
+        image_bytes (bytes): The raw bytes of the original image.
+
+    Returns:
+        dict: The response from the EyePop API, in the coordinates of the original image.
+    """
+    with METRICS.timer("downscale"):
+        upload_bytes, mime_type, scale = downscale_image(image_bytes, max_dim, image_format, quality)
+    METRICS.observe("upload_bytes_saved", len(image_bytes) - len(upload_bytes))
+    return rescale_response(predict_bytes(upload_bytes, mime_type), scale)
@@ -0,0 +1,149 @@
+"""
+Re-runs the nutrition extraction over an archive of raw EyePop responses (JSON lines, one
+response per line, or records with the response under a 'response' key), e.g. after
+NUTRITIONS or THRESHOLD changed, without calling the API again.
+
+The archive is streamed: lines are read lazily, parsed in chunks across a process pool with a
+bounded number of chunks in flight, and results are written as soon as they are ready, so
+memory stays flat whatever the size of the archive.
+
+Usage:
+    python reextract.py responses.jsonl -o nutrition.jsonl --workers 8
+    cat responses.jsonl | python reextract.py - --unordered > nutrition.jsonl
+"""
+import argparse
+import json
+import os
+import sys
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+from extraction import NUTRITIONS, THRESHOLD, get_nutrition_values
+
+# variables
+CHUNK_SIZE = 64  # lines sent to a worker at once
+CHUNKS_PER_WORKER = 4  # chunks in flight per worker, bounds the memory used
+
+
+def iter_chunks(lines, chunk_size=CHUNK_SIZE):
+    """
+    Lazily groups the lines of the archive into chunks of (line number, line) tuples.
+    """
+    numbered = enumerate(lines, start=1)
+    while True:
+        chunk = list(islice(numbered, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def extract_chunk(chunk, nutritions, threshold, confidence_threshold):
+    """
+    Extracts the nutrition of every response in a chunk of lines, run in a worker process.
+    The JSON is decoded and encoded in the worker too, so the main process only moves strings.
+
+    Args:
+        chunk (list): (line number, line) tuples.
+        nutritions (list): Keywords representing the nutrition to look for.
+        threshold (int or float): Threshold for proximity in 'y' values.
+        confidence_threshold (float): Minimum confidence level for valid objects.
+
+    Returns:
+        list: One output JSON line per non blank input line.
+    """
+    output = []
+    for line_no, line in chunk:
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            response = record.get("response", record)
+            result = {"line": line_no}
+            if "image" in record:
+                result["image"] = record["image"]
+            result["nutrition"] = get_nutrition_values(response, nutritions, threshold, confidence_threshold)
+        except Exception as e:
+            result = {"line": line_no, "error": f"{type(e).__name__}: {e}"}
+        output.append(json.dumps(result) + "\n")
+    return output
+
+
+def reextract(lines, out, workers=None, chunk_size=CHUNK_SIZE, ordered=True, nutritions=NUTRITIONS, threshold=THRESHOLD, confidence_threshold=0.5):
+    """
+    Streams the archive through a pool of worker processes and writes the results to `out`.
+
+    Args:
+        lines (iterable): Lines of the archive, e.g. an open file.
+        out (file): Where to write one JSON line per response.
+        workers (int): Number of worker processes, the number of CPUs by default.
+        chunk_size (int): Number of lines sent to a worker at once.
+        ordered (bool): Whether to write the results in the order of the archive. Unordered
+            output writes each chunk as soon as it is done, which keeps every worker busy.
+        nutritions (list): Keywords representing the nutrition to look for.
+        threshold (int or float): Threshold for proximity in 'y' values.
+        confidence_threshold (float): Minimum confidence level for valid objects.
+
+    Returns:
+        int: The number of results written.
+    """
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = workers * CHUNKS_PER_WORKER
+    written = 0
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque() if ordered else set()
+
+        def drain():
+            nonlocal pending, written
+            if ordered:
+                # wait for the oldest chunk, the later ones keep running meanwhile
+                done = [pending.popleft()]
+            else:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                results = future.result()
+                out.writelines(results)
+                written += len(results)
+
+        for chunk in iter_chunks(lines, chunk_size):
+            if len(pending) >= max_in_flight:
+                drain()
+            submitted = executor.submit(extract_chunk, chunk, nutritions, threshold, confidence_threshold)
+            if ordered:
+                pending.append(submitted)
+            else:
+                pending.add(submitted)
+        while pending:
+            drain()
+
+    out.flush()
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("archive", help="JSON lines file of responses, - for stdin")
+    parser.add_argument("-o", "--output", default="-", help="JSON lines file to write, stdout by default")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="lines per chunk sent to a worker")
+    parser.add_argument("--unordered", action="store_true", help="write results as they finish")
+    parser.add_argument("--confidence", type=float, default=0.5, help="confidence threshold")
+    args = parser.parse_args()
+
+    archive = sys.stdin if args.archive == "-" else open(args.archive)
+    out = sys.stdout if args.output == "-" else open(args.output, "w")
+    try:
+        count = reextract(
+            archive,
+            out,
+            workers=args.workers,
+            chunk_size=args.chunk_size,
+            ordered=not args.unordered,
+            confidence_threshold=args.confidence,
+        )
+    finally:
+        if archive is not sys.stdin:
+            archive.close()
+        if out is not sys.stdout:
+            out.close()
+    print(f"re-extracted {count} responses", file=sys.stderr)
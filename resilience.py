@@ -0,0 +1,257 @@
+import contextvars
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from extraction.metrics import METRICS, percentile
+
+# variables
+BUDGET = float(os.getenv("EYEPOP_BUDGET", 30))  # seconds a prediction may take, retries included
+MAX_ATTEMPTS = int(os.getenv("EYEPOP_MAX_ATTEMPTS", 3))
+BACKOFF_BASE = 0.5  # seconds before the first retry, doubled on every retry
+BACKOFF_CAP = 8.0
+HEDGE = os.getenv("EYEPOP_HEDGE", "1") == "1"
+HEDGE_PERCENTILE = 95  # a request slower than this percentile of the recent ones gets a duplicate
+HEDGE_MIN_SAMPLES = 20  # no hedging until this many requests were timed
+BREAKER_FAILURES = int(os.getenv("EYEPOP_BREAKER_FAILURES", 5))  # consecutive failures that open the circuit
+BREAKER_RESET = float(os.getenv("EYEPOP_BREAKER_RESET", 30))  # seconds before trying again
+
+
+class LatencyBudgetExceeded(TimeoutError):
+    """
+    Raised when a prediction did not succeed within its latency budget.
+    """
+
+
+class CircuitOpenError(RuntimeError):
+    """
+    Raised without calling the endpoint while the circuit breaker is open.
+    """
+
+
+class CircuitBreaker:
+    """
+    Fails fast while the endpoint is unhealthy instead of making every caller wait for its own
+    timeout. After `failures` consecutive failures the circuit opens and calls are refused for
+    `reset_timeout` seconds, then a single trial call is let through (half open): the circuit
+    closes again if it succeeds, or stays open for another `reset_timeout` if it fails.
+    """
+
+    def __init__(self, failures=BREAKER_FAILURES, reset_timeout=BREAKER_RESET, clock=time.monotonic):
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._trial = False  # whether the trial call of the half open state is in flight
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        """
+        'closed', 'open' or 'half_open'.
+        """
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if self.clock() - self.opened_at >= self.reset_timeout else "open"
+
+    def allow(self):
+        """
+        Whether a call may go through now. In the half open state only one caller is allowed.
+        """
+        with self._lock:
+            state = self._state()
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.consecutive_failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self._trial or self.consecutive_failures >= self.failures:
+                if self._state() == "closed":
+                    METRICS.increment("circuit_opened")
+                self.opened_at = self.clock()
+            self._trial = False
+
+
+class ResilientPredictor:
+    """
+    Bounds the latency of predictions: each call has a latency budget, failed attempts are
+    retried with jittered exponential backoff while the budget allows, an attempt slower than
+    the recent p95 gets a duplicate (hedged) request whose first response wins, if the pool has
+    an endpoint free for it, and a circuit breaker refuses calls while the endpoint keeps failing.
+
+    Has the same `predict_bytes` as `EndpointPool`, so it can be passed wherever the pool is.
+    The pool's own retry of a stale connection is turned off, each attempt calls the endpoint
+    once and a call makes at most `max_attempts` attempts, plus the hedges.
+    A timed out attempt cannot be cancelled, it keeps its pooled endpoint until it returns and
+    its response is dropped.
+    """
+
+    def __init__(
+        self,
+        pool,
+        budget=BUDGET,
+        max_attempts=MAX_ATTEMPTS,
+        backoff_base=BACKOFF_BASE,
+        backoff_cap=BACKOFF_CAP,
+        hedge=HEDGE,
+        hedge_after=None,
+        breaker=None,
+        workers=32,
+        seed=None,
+    ):
+        """
+        Args:
+            pool (EndpointPool): The pool the requests are sent with.
+            budget (float): Seconds a call may take, retries and backoff included, None for no limit.
+            max_attempts (int): Maximum number of attempts of a call, hedged duplicates not counted.
+            backoff_base (float): Maximum seconds before the first retry, doubled on every retry.
+            backoff_cap (float): Maximum seconds between two attempts.
+            hedge (bool): Whether to send a duplicate request when an attempt is slow.
+            hedge_after (float): Seconds before hedging, the p95 of the recent attempts by default.
+            breaker (CircuitBreaker): The circuit breaker, a new one by default.
+            workers (int): Maximum number of attempts in flight across every caller.
+            seed (int): Seed of the backoff jitter.
+        """
+        self.pool = pool
+        self.budget = budget
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.hedge = hedge
+        self.hedge_after = hedge_after
+        self.breaker = breaker or CircuitBreaker()
+        self.latencies = deque(maxlen=1000)  # seconds of the recent successful attempts
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+
+    def predict(self, location):
+        """
+        Same as `EndpointPool.predict`, within the latency budget.
+        """
+        return self.call(lambda: self.pool.predict(location, retry=False))
+
+    def predict_bytes(self, image_bytes, mime_type="image/png"):
+        """
+        Same as `EndpointPool.predict_bytes`, within the latency budget.
+        """
+        return self.call(lambda: self.pool.predict_bytes(image_bytes, mime_type, retry=False))
+
+    def call(self, request):
+        """
+        Calls `request` (without arguments) with retries and hedging until it succeeds, the
+        attempts run out or the budget is spent.
+
+        Raises:
+            CircuitOpenError: The endpoint kept failing recently, it was not called.
+            LatencyBudgetExceeded: No attempt succeeded within the budget.
+            Exception: The error of the last attempt, once `max_attempts` failed.
+        """
+        deadline = None if self.budget is None else time.monotonic() + self.budget
+        for attempt in range(self.max_attempts):
+            if not self.breaker.allow():
+                METRICS.increment("circuit_rejected")
+                raise CircuitOpenError("the EyePop endpoint is failing, not calling it for now")
+            try:
+                response = self._attempt(request, deadline)
+            except LatencyBudgetExceeded:
+                self.breaker.record_failure()
+                METRICS.increment("budget_exceeded")
+                raise
+            except Exception as e:
+                self.breaker.record_failure()
+                if attempt + 1 >= self.max_attempts:
+                    raise
+                delay = self._backoff(attempt)
+                if deadline is not None and time.monotonic() + delay >= deadline:
+                    METRICS.increment("budget_exceeded")
+                    raise LatencyBudgetExceeded(f"no time left in the {self.budget}s budget to retry") from e
+                METRICS.increment("prediction_retries")
+                time.sleep(delay)
+                continue
+            self.breaker.record_success()
+            return response
+
+    def hedge_delay(self):
+        """
+        Gets the seconds after which a slow attempt is hedged, None if it should not be.
+        """
+        if not self.hedge:
+            return None
+        if self.hedge_after is not None:
+            return self.hedge_after
+        latencies = list(self.latencies)
+        if len(latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        return percentile(latencies, HEDGE_PERCENTILE)
+
+    def close(self):
+        """
+        Stops the worker threads, once the attempts in flight returned.
+        """
+        self._executor.shutdown(wait=False)
+
+    def _backoff(self, attempt):
+        # "full jitter": spreads the retries of callers that failed together
+        with self._rng_lock:
+            return self._rng.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    def _timed(self, request):
+        start = time.perf_counter()
+        response = request()
+        self.latencies.append(time.perf_counter() - start)
+        return response
+
+    def _submit(self, request):
+        # run in the caller's context, so the stages are added to its `METRICS.request` trace
+        return self._executor.submit(contextvars.copy_context().run, self._timed, request)
+
+    def _free_endpoint(self):
+        # a hedge waiting for an endpoint would only take it from another request
+        available = getattr(self.pool, "available", None)
+        return available is None or available() > 0
+
+    def _attempt(self, request, deadline):
+        primary = self._submit(request)
+        pending = {primary}
+        hedge_delay = self.hedge_delay()
+        if hedge_delay is not None and (deadline is None or time.monotonic() + hedge_delay < deadline):
+            done, _ = wait(pending, timeout=hedge_delay)
+            if not done and self._free_endpoint():
+                # slower than most requests, a duplicate is likely to come back first
+                METRICS.increment("hedged_requests")
+                pending.add(self._submit(request))
+            elif not done:
+                METRICS.increment("hedges_skipped")
+
+        errors = []
+        while pending:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                raise LatencyBudgetExceeded(f"no response within the {self.budget}s budget")
+            for future in done:
+                if future.exception() is None:
+                    if future is not primary:
+                        METRICS.increment("hedge_wins")
+                    return future.result()
+                errors.append(future.exception())
+        raise errors[0]
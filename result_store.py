@@ -0,0 +1,336 @@
+"""
+Persistent store of the extracted nutrition, so results can be queried and exported for
+analytics without extracting them again or calling EyePop again.
+
+Every result is kept as a row of `results` (image, content hash, time, nutrition as JSON) and
+one row of `nutrients` per value, with the amount parsed and converted to grams for the mass
+units, so e.g. every label with more than 500mg of sodium is an indexed range query.
+
+Usage:
+    python result_store.py import results.jsonl
+    python result_store.py query sodium --above 500mg
+    python result_store.py export nutrition.parquet
+    python result_store.py renormalize
+"""
+import argparse
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from extraction import NUTRITIONS, find_nutrition_keyword, parse_quantity
+
+# variables
+STORE_PATH = os.getenv(
+    "RESULT_STORE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "results.sqlite3"),
+)
+_COLUMN = re.compile(r"^(.*)_(\d+)$")
+_OPERATORS = (">", ">=", "<", "<=", "=")
+
+
+def parse_amount(value, unit=None):
+    """
+    Parses a value such as '430mg', or a number with its unit given apart, see `parse_quantity`.
+
+    Returns:
+        tuple: The amount, the canonical unit ('' if none) and the amount in grams (None if
+        the unit is not a mass), or (None, None, None) if the value is not an amount.
+    """
+    quantity = parse_quantity(value, unit)
+    if quantity is None:
+        return None, None, None
+    return quantity.amount, quantity.unit, quantity.grams
+
+
+def nutrient_rows(nutrition, nutritions=NUTRITIONS):
+    """
+    Splits the output of `get_nutrition_values` into one (name, nutrient, position, value, amount,
+    unit, grams) tuple per value, e.g. 'Total fat_1': '13g' is
+    ('total fat', 'fat', 1, '13g', 13.0, 'g', 13.0).
+    """
+    rows = []
+    for key, value in nutrition.items():
+        match = _COLUMN.match(key)
+        name, position = (match.group(1), int(match.group(2))) if match else (key, 0)
+        name = name.lower()
+        nutrient = find_nutrition_keyword(name, nutritions) or name
+        rows.append((name, nutrient, position, str(value), *parse_amount(value)))
+    return rows
+
+
+class ResultStore:
+    """
+    SQLite store of extracted nutrition, indexed on the image hash, the nutrient (with its amount)
+    and the time the result was stored.
+    """
+
+    def __init__(self, path=STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # shared between threads, access is serialized by the lock
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS results (
+                id INTEGER PRIMARY KEY,
+                image TEXT,
+                image_key TEXT,
+                created_at REAL NOT NULL,
+                nutrition TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS nutrients (
+                result_id INTEGER NOT NULL REFERENCES results (id) ON DELETE CASCADE,
+                name TEXT NOT NULL,
+                nutrient TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                value TEXT NOT NULL,
+                amount REAL,
+                unit TEXT,
+                grams REAL
+            );
+            CREATE INDEX IF NOT EXISTS results_image_key ON results (image_key);
+            CREATE INDEX IF NOT EXISTS results_created_at ON results (created_at);
+            CREATE INDEX IF NOT EXISTS nutrients_nutrient_grams ON nutrients (nutrient, grams);
+            CREATE INDEX IF NOT EXISTS nutrients_nutrient_amount ON nutrients (nutrient, amount);
+            CREATE INDEX IF NOT EXISTS nutrients_result_id ON nutrients (result_id);
+            """
+        )
+
+    def add(self, nutrition, image=None, image_key=None):
+        """
+        Stores one result, see `add_many`.
+        """
+        return self.add_many([{"image": image, "image_key": image_key, "nutrition": nutrition}])
+
+    def add_many(self, records):
+        """
+        Stores the results in a single transaction, much faster than one transaction per result.
+
+        Args:
+            records (iterable): {'nutrition', 'image', 'image_key'} dictionaries, e.g. the records
+                of `batch.py`. Records without 'nutrition' (failed images) are skipped.
+
+        Returns:
+            int: The number of results stored.
+        """
+        now = time.time()
+        count = 0
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for record in records:
+                    if record.get("nutrition") is None:
+                        continue
+                    result_id = self._conn.execute(
+                        "INSERT INTO results (image, image_key, created_at, nutrition) VALUES (?, ?, ?, ?)",
+                        (record.get("image"), record.get("image_key"), record.get("created_at", now), json.dumps(record["nutrition"])),
+                    ).lastrowid
+                    self._conn.executemany(
+                        "INSERT INTO nutrients VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        [(result_id, *row) for row in nutrient_rows(record["nutrition"])],
+                    )
+                    count += 1
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return count
+
+    def query(self, nutrient, op=">", value=None, since=None, latest=True):
+        """
+        Finds the results with a value of the nutrient satisfying the comparison, e.g.
+        `query('sodium', '>', '500mg')`. Mass units are compared in grams, so '0.5g' gives the
+        same results; a value without unit is compared with the amounts as they are.
+
+        Args:
+            nutrient (str): A keyword of NUTRITIONS (e.g. 'fat' matches 'Total fat' and 'Saturated fat'),
+                or the full name of the nutrition in lower case.
+            op (str): One of '>', '>=', '<', '<=', '='.
+            value (str or float): The amount to compare with, None to get every result with the nutrient.
+            since (float): Only the results stored at or after this timestamp.
+            latest (bool): Only the latest result of each image hash.
+
+        Returns:
+            list: {'id', 'image', 'image_key', 'created_at', 'nutrition'} dictionaries, newest first.
+        """
+        if op not in _OPERATORS:
+            raise ValueError(f"unknown operator {op!r}, expected one of {', '.join(_OPERATORS)}")
+        where = ["(n.nutrient = ? OR n.name = ?)"]
+        params = [nutrient.lower(), nutrient.lower()]
+        if value is not None:
+            amount, _, grams = parse_amount(value)
+            if amount is None:
+                raise ValueError(f"{value!r} is not an amount")
+            where.append(f"n.grams {op} ?" if grams is not None else f"n.amount {op} ?")
+            params.append(grams if grams is not None else amount)
+        if since is not None:
+            where.append("r.created_at >= ?")
+            params.append(since)
+        if latest:
+            # a result stored again for the same image replaces the previous one
+            where.append(
+                "(r.image_key IS NULL OR r.id = (SELECT MAX(id) FROM results WHERE image_key = r.image_key))"
+            )
+
+        with self._lock:
+            rows = self._conn.execute(
+                f"""
+                SELECT DISTINCT r.id, r.image, r.image_key, r.created_at, r.nutrition
+                FROM nutrients n JOIN results r ON r.id = n.result_id
+                WHERE {' AND '.join(where)}
+                ORDER BY r.created_at DESC, r.id DESC
+                """,
+                params,
+            ).fetchall()
+        return [
+            {"id": row[0], "image": row[1], "image_key": row[2], "created_at": row[3], "nutrition": json.loads(row[4])}
+            for row in rows
+        ]
+
+    def get(self, image_key):
+        """
+        Gets the latest result stored for the image hash, or None.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT nutrition FROM results WHERE image_key = ? ORDER BY id DESC LIMIT 1", (image_key,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def to_dataframe(self, wide=True):
+        """
+        Gets every stored result as a pandas DataFrame.
+
+        Args:
+            wide (bool): One row per result with one column per nutrition, like the dashboard
+                table, or else one row per value with its parsed amount, unit and grams.
+        """
+        import pandas as pd
+
+        with self._lock:
+            if wide:
+                rows = self._conn.execute("SELECT id, image, image_key, created_at, nutrition FROM results ORDER BY id").fetchall()
+            else:
+                long = pd.read_sql_query(
+                    """
+                    SELECT r.id, r.image, r.image_key, r.created_at, n.name, n.nutrient, n.position, n.value, n.amount, n.unit, n.grams
+                    FROM nutrients n JOIN results r ON r.id = n.result_id
+                    ORDER BY r.id, n.rowid
+                    """,
+                    self._conn,
+                )
+        if not wide:
+            return long
+        return pd.DataFrame(
+            [{"id": row[0], "image": row[1], "image_key": row[2], "created_at": row[3], **json.loads(row[4])} for row in rows],
+            columns=None if rows else ["id", "image", "image_key", "created_at"],
+        )
+
+    def export(self, path, wide=True):
+        """
+        Exports every stored result to a Parquet (needs pyarrow or fastparquet) or CSV file,
+        picked from the extension of the path.
+        """
+        df = self.to_dataframe(wide)
+        if path.endswith(".parquet"):
+            # parquet needs string column names
+            df.columns = [str(column) for column in df.columns]
+            df.to_parquet(path, index=False)
+        else:
+            df.to_csv(path, index=False)
+        return len(df)
+
+    def renormalize(self, batch_size=10_000):
+        """
+        Parses every stored value again with `parse_quantity`, e.g. after it learned a new unit,
+        in a single transaction. Labels repeat the same values, most of them hit its cache.
+
+        Returns:
+            int: The number of values whose amount, unit or grams changed.
+        """
+        changed = 0
+        last = 0
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                while True:
+                    rows = self._conn.execute(
+                        "SELECT rowid, value, amount, unit, grams FROM nutrients WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                        (last, batch_size),
+                    ).fetchall()
+                    if not rows:
+                        break
+                    last = rows[-1][0]
+                    updates = []
+                    for rowid, value, *stored in rows:
+                        parsed = parse_amount(value)
+                        if list(parsed) != stored:
+                            updates.append((*parsed, rowid))
+                    self._conn.executemany("UPDATE nutrients SET amount = ?, unit = ?, grams = ? WHERE rowid = ?", updates)
+                    changed += len(updates)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return changed
+
+    def stats(self):
+        """
+        Gets the number of results and values stored.
+        """
+        with self._lock:
+            results = self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+            values = self._conn.execute("SELECT COUNT(*) FROM nutrients").fetchone()[0]
+        return {"results": results, "values": values}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--path", default=STORE_PATH, help="SQLite file of the store")
+    commands = parser.add_subparsers(dest="command", required=True)
+    import_parser = commands.add_parser("import", help="store the records of a batch.py output file")
+    import_parser.add_argument("records", help="JSON lines file of {'image', 'nutrition'} records, - for stdin")
+    query_parser = commands.add_parser("query", help="find the results with a nutrient in a range")
+    query_parser.add_argument("nutrient", help="e.g. sodium")
+    query_parser.add_argument("--above", help="e.g. 500mg")
+    query_parser.add_argument("--below", help="e.g. 2g")
+    query_parser.add_argument("--all", action="store_true", help="include older results of the same image")
+    export_parser = commands.add_parser("export", help="export every result to .parquet or .csv")
+    export_parser.add_argument("output", help="path of the file to write")
+    export_parser.add_argument("--long", action="store_true", help="one row per value instead of per result")
+    commands.add_parser("renormalize", help="parse every stored value again into its amount and unit")
+    args = parser.parse_args()
+
+    store = ResultStore(args.path)
+    if args.command == "import":
+        lines = sys.stdin if args.records == "-" else open(args.records)
+        with lines:
+            count = store.add_many(json.loads(line) for line in lines if line.strip())
+        print(f"stored {count} results, {store.stats()['results']} in total", file=sys.stderr)
+    elif args.command == "query":
+        results = store.query(args.nutrient, ">", args.above, latest=not args.all)
+        if args.below is not None:
+            below = {result["id"] for result in store.query(args.nutrient, "<", args.below, latest=not args.all)}
+            results = [result for result in results if result["id"] in below]
+        for result in results:
+            print(json.dumps({"image": result["image"], "nutrition": result["nutrition"]}))
+        print(f"{len(results)} results", file=sys.stderr)
+    elif args.command == "export":
+        count = store.export(args.output, wide=not args.long)
+        print(f"exported {count} rows to {args.output}", file=sys.stderr)
+    else:
+        count = store.renormalize()
+        print(f"{count} of {store.stats()['values']} values changed", file=sys.stderr)
+    store.close()
@@ -0,0 +1,471 @@
+"""
+Local HTTP service extracting the nutrition of label images, so other services can share one
+warm process (pooled endpoints, prediction cache, parsing workers) instead of embedding a copy
+of the parsing code.
+
+Requests are micro-batched: the ones arriving within `window` seconds of the first are handled
+together, the images of a batch are sent to EyePop concurrently through the pooled endpoints
+(an image sent twice is predicted once), the responses posted by the clients are parsed in a
+single call to the worker pool and the ones of the images as soon as they come back. At most
+`max_batches` batches are in flight; while they are, requests wait in a queue of at most
+`max_queue`, beyond which they are refused with 503 and a Retry-After header instead of piling
+up.
+
+Endpoints:
+    POST /extract   the image as the body, or a JSON EyePop response ({"objects": [...]}),
+                    ?confidence=0.5 sets the confidence threshold
+    GET /health     queue depth, batches in flight and counters
+    GET /metrics    the pipeline metrics in the Prometheus format
+
+Usage:
+    python server.py --port 8080 --pool-size 4
+    python server.py --fake --predict-median 0.8     # against the local fake endpoint
+    curl --data-binary @label.png "localhost:8080/extract?confidence=0.6"
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+from PIL import UnidentifiedImageError
+from extraction import NUTRITIONS, THRESHOLD, get_nutrition_values
+from extraction.metrics import METRICS
+from prediction_cache import image_key
+from preprocess import predict_downscaled, settings_id
+from resilience import CircuitOpenError, LatencyBudgetExceeded
+
+# variables
+HOST = os.getenv("SERVICE_HOST", "127.0.0.1")
+PORT = int(os.getenv("SERVICE_PORT", 8080))
+BATCH_WINDOW = float(os.getenv("SERVICE_BATCH_WINDOW", 0.01))  # seconds a batch waits for more requests
+MAX_BATCH = int(os.getenv("SERVICE_MAX_BATCH", 32))
+MAX_BATCHES = int(os.getenv("SERVICE_MAX_BATCHES", 4))  # batches in flight
+MAX_QUEUE = int(os.getenv("SERVICE_MAX_QUEUE", 256))  # requests waiting for a batch
+MAX_BODY = int(os.getenv("SERVICE_MAX_BODY", 20 * 1024 * 1024))
+RETRY_AFTER = 1  # seconds a refused client is told to wait
+
+# errors of a request and the status they are answered with, the first match wins
+ERROR_STATUS = [
+    (CircuitOpenError, HTTPStatus.SERVICE_UNAVAILABLE),
+    (LatencyBudgetExceeded, HTTPStatus.GATEWAY_TIMEOUT),
+    (UnidentifiedImageError, HTTPStatus.BAD_REQUEST),
+    (ValueError, HTTPStatus.BAD_REQUEST),
+    (Exception, HTTPStatus.BAD_GATEWAY),
+]
+
+
+class Overloaded(Exception):
+    """
+    Raised when the request queue is full, the client should retry later.
+    """
+
+
+def parse_batch(responses, confidence_thresholds):
+    """
+    Extracts the nutrition of every response of a batch, in one round trip to a worker.
+
+    Returns:
+        list: The output of `get_nutrition_values` for each response, or the exception it
+        raised, so a malformed response only fails its own request.
+    """
+    results = []
+    for response, confidence_threshold in zip(responses, confidence_thresholds):
+        try:
+            results.append(get_nutrition_values(response, NUTRITIONS, THRESHOLD, confidence_threshold))
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+class _Job:
+    """
+    A request waiting for its batch, with either the image or the response to extract.
+    """
+
+    def __init__(self, future, image_bytes=None, response=None, confidence_threshold=0.5):
+        self.future = future
+        self.image_bytes = image_bytes
+        self.response = response
+        self.confidence_threshold = confidence_threshold
+
+
+def _settle(future, result=None, error=None):
+    if future.done():
+        return  # the client went away
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+class ExtractionService:
+    """
+    Micro-batches extraction requests and runs them with the pooled endpoints and a worker pool.
+    Must be started (and used) within a running event loop.
+    """
+
+    def __init__(
+        self,
+        predictor,
+        cache=None,
+        window=BATCH_WINDOW,
+        max_batch=MAX_BATCH,
+        max_batches=MAX_BATCHES,
+        max_queue=MAX_QUEUE,
+        parse_workers=None,
+        downscale=True,
+    ):
+        """
+        Args:
+            predictor (EndpointPool): Pool of endpoints the images are sent with, or a `ResilientPredictor` around it.
+            cache (PredictionCache): Optional cache of predictions.
+            window (float): Seconds a batch waits for more requests after its first one, 0 to not wait.
+            max_batch (int): Maximum number of requests in a batch.
+            max_batches (int): Maximum number of batches in flight.
+            max_queue (int): Maximum number of requests waiting for a batch, beyond which they are refused.
+            parse_workers (int): Number of processes parsing the responses, the number of CPUs by default.
+            downscale (bool): Whether to downscale the images before upload, see `predict_downscaled`.
+        """
+        self.predictor = predictor
+        self.cache = cache
+        self.window = window
+        self.max_batch = max_batch
+        self.max_batches = max_batches
+        self.max_queue = max_queue
+        self.parse_workers = parse_workers
+        self.downscale = downscale
+        self.batches_in_flight = 0
+        self._queue = None
+        self._batcher = None
+        self._batches = set()
+
+    async def start(self):
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._slots = asyncio.Semaphore(self.max_batches)
+        # the pool bounds the uploads in flight, these threads only wait on it
+        self._uploads = ThreadPoolExecutor(max_workers=self.max_batch * self.max_batches)
+        self._parse_pool = ProcessPoolExecutor(max_workers=self.parse_workers)
+        # start the workers now: forked by the first request, they would inherit its connection
+        # and keep it open after the server closed it, and that request would pay their startup
+        await asyncio.get_running_loop().run_in_executor(self._parse_pool, parse_batch, [], [])
+        self._batcher = asyncio.create_task(self._run_batcher())
+
+    async def close(self):
+        """
+        Stops batching and waits for the batches in flight.
+        """
+        self._batcher.cancel()
+        await asyncio.gather(self._batcher, *self._batches, return_exceptions=True)
+        self._uploads.shutdown()
+        self._parse_pool.shutdown()
+
+    async def extract(self, image_bytes=None, response=None, confidence_threshold=0.5):
+        """
+        Extracts the nutrition of an image, or of an EyePop response computed beforehand.
+
+        Returns:
+            dict: The output of `get_nutrition_values`.
+
+        Raises:
+            Overloaded: Too many requests are already waiting.
+        """
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait(_Job(future, image_bytes, response, confidence_threshold))
+        except asyncio.QueueFull:
+            METRICS.increment("service_rejected")
+            raise Overloaded(f"{self.max_queue} requests are already waiting") from None
+        return await future
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "max_queue": self.max_queue,
+            "batches_in_flight": self.batches_in_flight,
+            "max_batches": self.max_batches,
+            "counters": {
+                name: int(value) for name, value in METRICS.counters.items() if name.startswith("service_")
+            },
+        }
+
+    async def _run_batcher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # the batcher stops taking requests while every slot is busy, so they wait in the
+            # bounded queue and the ones beyond it are refused
+            await self._slots.acquire()
+            self.batches_in_flight += 1
+            task = asyncio.create_task(self._run_batch(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batch_done)
+
+    def _batch_done(self, task):
+        self._batches.discard(task)
+        self.batches_in_flight -= 1
+        self._slots.release()
+
+    def _predict(self, image_bytes):
+        def predict():
+            if self.downscale:
+                return predict_downscaled(self.predictor.predict_bytes, image_bytes)
+            return self.predictor.predict_bytes(image_bytes)
+
+        with METRICS.request("service"):
+            if self.cache is None:
+                return predict()
+            return self.cache.get_or_predict(image_bytes, predict, os.getenv("EYEPOP_POP_ID"), settings_id())
+
+    async def _run_batch(self, batch):
+        METRICS.increment("service_batches")
+        METRICS.increment("service_requests", len(batch))
+        METRICS.observe("service_batch_size", len(batch))
+
+        # the responses sent by the clients are parsed right away, the ones of the images as
+        # soon as their prediction is back, no job waits for the slowest image of its batch
+        images = {}
+        responses = []
+        for job in batch:
+            if job.image_bytes is None:
+                responses.append(job)
+            else:
+                images.setdefault(image_key(job.image_bytes), []).append(job)
+        METRICS.increment("service_deduplicated", len(batch) - len(responses) - len(images))
+
+        steps = [self._predict_and_parse(jobs) for jobs in images.values()]
+        if responses:
+            steps.append(self._parse(responses))
+        await asyncio.gather(*steps)
+
+    async def _predict_and_parse(self, jobs):
+        # the jobs all have the same image, it is sent once
+        try:
+            response = await asyncio.get_running_loop().run_in_executor(self._uploads, self._predict, jobs[0].image_bytes)
+        except Exception as e:
+            for job in jobs:
+                _settle(job.future, error=e)
+            return
+        for job in jobs:
+            job.response = response
+        await self._parse(jobs)
+
+    async def _parse(self, jobs):
+        try:
+            with METRICS.timer("service_parse"):
+                results = await asyncio.get_running_loop().run_in_executor(
+                    self._parse_pool,
+                    parse_batch,
+                    [job.response for job in jobs],
+                    [job.confidence_threshold for job in jobs],
+                )
+        except Exception as e:
+            results = [e] * len(jobs)
+        for job, result in zip(jobs, results):
+            if not isinstance(result, Exception):
+                _settle(job.future, result)
+            elif job.image_bytes is None:
+                # the client sent a response that is not a valid EyePop response
+                _settle(job.future, error=ValueError(f"cannot parse the response, {type(result).__name__}: {result}"))
+            else:
+                _settle(job.future, error=result)
+
+
+class ExtractionServer:
+    """
+    Minimal HTTP/1.1 front end of an `ExtractionService`, with keep-alive connections.
+    """
+
+    def __init__(self, service, max_body=MAX_BODY):
+        self.service = service
+        self.max_body = max_body
+
+    async def serve(self, host=HOST, port=PORT):
+        """
+        Starts the service and serves until cancelled.
+        """
+        await self.service.start()
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"serving on http://{host}:{port}", file=sys.stderr)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.service.close()
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await self.read_head(reader)
+                except ValueError as e:
+                    # the request cannot be framed, so neither can the next one on this connection
+                    await self.respond(writer, HTTPStatus.BAD_REQUEST, {"error": str(e)}, keep_alive=False)
+                    break
+                if head is None:
+                    break
+                method, target, version, headers = head
+
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                length = int(headers.get("content-length", 0))
+                if "transfer-encoding" in headers:
+                    status, body = HTTPStatus.LENGTH_REQUIRED, {"error": "chunked bodies are not supported"}
+                    keep_alive = False
+                elif length > self.max_body:
+                    status, body = HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {"error": f"body over {self.max_body} bytes"}
+                    keep_alive = False  # the body was not read
+                else:
+                    status, body = await self.route(method, target, headers, await reader.readexactly(length))
+                await self.respond(writer, status, body, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass  # the client went away, nothing to answer
+        except asyncio.CancelledError:
+            pass  # the server is shutting down, idle keep-alive connections are dropped
+        finally:
+            writer.close()
+
+    async def read_head(self, reader):
+        """
+        Reads the request line and headers of the next request, None once the client is done.
+
+        Raises:
+            ValueError: The request line, a header line or the Content-Length is malformed.
+        """
+        async def readline():
+            try:
+                return await reader.readline()
+            except ValueError:
+                raise ValueError("request line or header too long") from None  # over the stream's limit
+
+        request_line = await readline()
+        if not request_line.strip():
+            return None
+        parts = request_line.decode("latin-1").split()
+        if len(parts) != 3 or not parts[2].startswith("HTTP/"):
+            raise ValueError(f"malformed request line {request_line.strip()[:100]!r}")
+        headers = {}
+        while True:
+            line = await readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        # digits only, int() would also take '-1', ' 1_0' or '+5'
+        length = headers.get("content-length", "0")
+        if not (length.isascii() and length.isdigit()):
+            raise ValueError(f"invalid Content-Length {length[:100]!r}")
+        return (*parts, headers)
+
+    async def route(self, method, target, headers, body):
+        """
+        Gets the status and body (a dict, or text) of the answer to a request.
+        """
+        url = urlsplit(target)
+        if url.path == "/health" and method == "GET":
+            return HTTPStatus.OK, self.service.stats()
+        if url.path == "/metrics" and method == "GET":
+            return HTTPStatus.OK, METRICS.to_prometheus()
+        if url.path != "/extract":
+            return HTTPStatus.NOT_FOUND, {"error": f"no such endpoint {url.path}"}
+        if method != "POST":
+            return HTTPStatus.METHOD_NOT_ALLOWED, {"error": "use POST"}
+
+        try:
+            query = parse_qs(url.query)
+            confidence_threshold = float(query.get("confidence", [0.5])[0])
+            if headers.get("content-type", "").startswith("application/json"):
+                response = json.loads(body)
+                if isinstance(response, dict):
+                    response = response.get("response", response)  # a record of the recorded responses
+                if not isinstance(response, dict) or not isinstance(response.get("objects"), list):
+                    raise ValueError("the JSON body is not an EyePop response with an 'objects' list")
+                nutrition = await self.service.extract(response=response, confidence_threshold=confidence_threshold)
+                return HTTPStatus.OK, {"nutrition": nutrition}
+            if not body:
+                raise ValueError("the body should be an image or a JSON EyePop response")
+            nutrition = await self.service.extract(image_bytes=body, confidence_threshold=confidence_threshold)
+            return HTTPStatus.OK, {"image_key": image_key(body), "nutrition": nutrition}
+        except Overloaded as e:
+            return HTTPStatus.SERVICE_UNAVAILABLE, {"error": str(e)}
+        except Exception as e:
+            status = next(status for error, status in ERROR_STATUS if isinstance(e, error))
+            return status, {"error": f"{type(e).__name__}: {e}"}
+
+    async def respond(self, writer, status, body, keep_alive):
+        if isinstance(body, str):
+            payload, content_type = body.encode(), "text/plain; version=0.0.4"
+        else:
+            payload, content_type = json.dumps(body).encode(), "application/json"
+        head = [
+            f"HTTP/1.1 {status.value} {status.phrase}",
+            f"Content-Type: {content_type}",
+            f"Content-Length: {len(payload)}",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}",
+        ]
+        if status == HTTPStatus.SERVICE_UNAVAILABLE:
+            head.append(f"Retry-After: {RETRY_AFTER}")
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + payload)
+        await writer.drain()
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from endpoint_pool import EndpointPool
+    from prediction_cache import PredictionCache
+    from resilience import BUDGET, ResilientPredictor
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=HOST, help="address to listen on")
+    parser.add_argument("--port", type=int, default=PORT, help="port to listen on")
+    parser.add_argument("--pool-size", type=int, default=4, help="number of pooled endpoints")
+    parser.add_argument("--window", type=float, default=BATCH_WINDOW, help="seconds a batch waits for more requests")
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH, help="maximum number of requests in a batch")
+    parser.add_argument("--max-batches", type=int, default=MAX_BATCHES, help="maximum number of batches in flight")
+    parser.add_argument("--max-queue", type=int, default=MAX_QUEUE, help="requests waiting before new ones are refused")
+    parser.add_argument("--parse-workers", type=int, default=None, help="number of parsing processes")
+    parser.add_argument("--budget", type=float, default=BUDGET, help="seconds an image may take, retries included")
+    parser.add_argument("--no-cache", action="store_true", help="always call EyePop")
+    parser.add_argument("--no-downscale", action="store_true", help="upload the images as they are")
+    parser.add_argument("--fake", action="store_true", help="use the local fake endpoint instead of EyePop")
+    parser.add_argument("--predict-median", type=float, default=0.3, help="median seconds to predict, with --fake")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="probability of a failed prediction, with --fake")
+    args = parser.parse_args()
+    load_dotenv()
+
+    factory = None
+    if args.fake:
+        from fake_endpoint import fake_endpoint_factory, lognormal
+
+        factory = fake_endpoint_factory(predict_latency=lognormal(args.predict_median, 0.5), error_rate=args.error_rate)
+    pool = EndpointPool(size=args.pool_size, factory=factory)
+    predictor = ResilientPredictor(pool, budget=args.budget)
+    service = ExtractionService(
+        predictor,
+        cache=None if args.no_cache else PredictionCache(),
+        window=args.window,
+        max_batch=args.max_batch,
+        max_batches=args.max_batches,
+        max_queue=args.max_queue,
+        parse_workers=args.parse_workers,
+        downscale=not args.no_downscale,
+    )
+    try:
+        asyncio.run(ExtractionServer(service).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        predictor.close()
+        pool.close()
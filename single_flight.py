@@ -0,0 +1,75 @@
+import threading
+from extraction.metrics import METRICS
+
+
+class _Call:
+    """
+    A call in flight, that the callers asking for the same key wait on.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key: the first caller runs the function, the ones
+    arriving while it is in flight wait for it and get the same result (or exception) instead
+    of running their own copy, e.g. the same label uploaded by several sessions at once.
+
+    The key is forgotten as soon as the call finishes, so this only deduplicates concurrent
+    calls, remembering results is the job of the `PredictionCache`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        """
+        Runs `fn` for the key, unless a call for the same key is already in flight, in which
+        case its result is shared. Callers get the same object, they must not modify it.
+
+        Args:
+            key (str): Identifies identical calls, e.g. the `image_key` of the image.
+            fn (callable): Called without arguments by the first caller.
+
+        Returns:
+            The result of `fn`.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            METRICS.increment("coalesced_predictions")
+            METRICS.annotate("coalesced", True)
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def in_flight(self):
+        """
+        Gets the number of keys with a call in flight.
+        """
+        with self._lock:
+            return len(self._calls)
@@ -0,0 +1,47 @@
+import pytest
+
+from endpoint_pool import EndpointPool
+
+
+class Connection:
+    # an endpoint whose connection goes stale after its first request
+    def __enter__(self):
+        self.requests = 0
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+def stale_after_first(calls):
+    def request(endpoint):
+        calls.append(endpoint)
+        endpoint.requests += 1
+        if endpoint.requests > 1:
+            raise ConnectionError("stale")
+        return {"objects": []}
+
+    return request
+
+
+def test_a_stale_connection_is_retried_once_on_a_fresh_one():
+    pool = EndpointPool(size=1, factory=Connection)
+    calls = []
+    pool.run(stale_after_first(calls))
+    assert pool.run(stale_after_first(calls)) == {"objects": []}
+    assert len(calls) == 3
+    assert calls[2] is not calls[0]
+    assert (pool.connects, pool.reconnects) == (2, 1)
+
+
+def test_without_retry_a_stale_connection_fails_once():
+    pool = EndpointPool(size=1, factory=Connection)
+    calls = []
+    pool.run(stale_after_first(calls))
+    with pytest.raises(ConnectionError):
+        pool.run(stale_after_first(calls), retry=False)
+    assert len(calls) == 2
+    assert pool.reconnects == 0
+    # the broken connection was not returned to the pool
+    pool.run(stale_after_first(calls), retry=False)
+    assert pool.connects == 2
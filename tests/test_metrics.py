@@ -0,0 +1,22 @@
+import pytest
+
+from extraction.metrics import percentile
+
+
+@pytest.mark.parametrize(
+    "values, pct, expected",
+    [
+        ([1, 2, 3, 4, 5], 50, 3),
+        ([1, 2, 3, 4], 50, 2),
+        ([1, 2, 3, 4, 5], 0, 1),
+        ([1, 2, 3, 4, 5], 100, 5),
+        ([5, 1, 4, 2, 3], 90, 5),
+        (list(range(1, 101)), 95, 95),
+        (list(range(1, 101)), 7, 7),
+        (list(range(1, 21)), 95, 19),
+        ([0.25], 99, 0.25),
+        ([], 50, 0.0),
+    ],
+)
+def test_percentile_is_the_nearest_rank(values, pct, expected):
+    assert percentile(values, pct) == expected
@@ -0,0 +1,86 @@
+import random
+import re
+
+import pytest
+
+from extraction import (
+    NUTRITIONS,
+    THRESHOLD,
+    IncrementalParser,
+    compile_nutrition_matcher,
+    find_nutrition_keyword,
+    get_nutrition_values,
+    search_nutrition_keyword,
+)
+
+
+def alternation_keyword(text, nutritions):
+    # the plain alternation the trie-factored matcher replaces, longest keyword first
+    keywords = sorted(set(nutritions), key=len, reverse=True)
+    match = re.search("|".join(re.escape(nutr) for nutr in keywords), text.lower().replace(" ", ""))
+    return match.group() if match else None
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("Total Carbohydrate", "carbohydrate"),
+        ("Carbs", "carbs"),
+        ("Saturated Fat", "fat"),
+        ("Dietary Fiber", "fiber"),
+        ("Cho lesterol", "cholesterol"),
+        ("230mg", None),
+        ("", None),
+    ],
+)
+def test_find_nutrition_keyword(text, expected):
+    assert find_nutrition_keyword(text, NUTRITIONS) == expected
+
+
+def test_matcher_prefers_the_longest_keyword():
+    assert find_nutrition_keyword("carbohydrates", ["carb", "carbohydrate", "carbs"]) == "carbohydrate"
+    assert find_nutrition_keyword("a.b", ["a.b", "a"]) == "a.b"  # keywords are literal
+
+
+def test_no_keywords_never_match():
+    assert find_nutrition_keyword("calories", []) is None
+
+
+def test_trie_matches_like_an_alternation():
+    rng = random.Random(0)
+    alphabet = "abcfgnoprstuy. "
+    for _ in range(500):
+        vocabulary = ["".join(rng.choice(alphabet) for _ in range(rng.randint(1, 5))) for _ in range(rng.randint(1, 20))]
+        matcher = compile_nutrition_matcher(tuple(vocabulary))
+        for _ in range(10):
+            text = "".join(rng.choice(alphabet + "ABC") for _ in range(rng.randint(0, 15)))
+            assert search_nutrition_keyword(matcher, text) == alternation_keyword(text, vocabulary)
+
+
+def response_with_missing_fields(rng, n_objects):
+    # low confidence objects may come back without coordinates, a confidence or texts
+    words = ["Calories", "Total Fat", "Sodium", "Protein", "Sugars", "10g", "230mg", "5%", "200", "mg"]
+    objects = []
+    for _ in range(n_objects):
+        obj = {
+            "x": rng.uniform(0, 400),
+            "y": rng.choice([0, 10, 40, 80, 120]) + rng.uniform(0, 8),
+            "confidence": rng.random(),
+            "texts": [{"text": rng.choice(words)}],
+        }
+        for field in ("x", "y", "confidence", "texts"):
+            if rng.random() < 0.15:
+                del obj[field]
+        objects.append(obj)
+    return {"objects": objects}
+
+
+def test_incremental_parser_matches_with_missing_fields():
+    rng = random.Random(7)
+    for _ in range(50):
+        response = response_with_missing_fields(rng, rng.randint(0, 40))
+        parser = IncrementalParser(response, NUTRITIONS, THRESHOLD)
+        for confidence_threshold in (0.5, 0.0, 0.9, 0.3, 0.5):
+            assert parser.nutrition_values(confidence_threshold) == get_nutrition_values(
+                response, NUTRITIONS, THRESHOLD, confidence_threshold
+            )
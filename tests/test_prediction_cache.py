@@ -0,0 +1,98 @@
+import json
+
+import pytest
+
+from prediction_cache import PredictionCache
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+def response(i, padding=0):
+    return {"objects": [{"id": i, "text": "x" * padding}]}
+
+
+def size_of(value):
+    return len(json.dumps(value).encode())
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def make_cache(tmp_path, clock, **bounds):
+    bounds = {"max_entries": 100, "max_bytes": 1 << 20, "ttl": 60, **bounds}
+    return PredictionCache(str(tmp_path / "predictions.sqlite3"), clock=clock, **bounds)
+
+
+def test_entries_expire_after_the_ttl(tmp_path, clock):
+    cache = make_cache(tmp_path, clock, ttl=60)
+    cache.set("a", response(0))
+    clock.advance(59)
+    assert cache.get("a") == response(0)
+    clock.advance(2)
+    assert cache.get("a") is None
+
+    # the next insert removes the expired entry from the file and the totals
+    cache.set("b", response(1))
+    assert cache.stats()["entries"] == 1
+    assert cache.stats()["bytes"] == size_of(response(1))
+
+
+def test_entry_bound_evicts_the_least_recently_used(tmp_path, clock):
+    cache = make_cache(tmp_path, clock, max_entries=3)
+    for key in "abc":
+        cache.set(key, response(ord(key)))
+        clock.advance(1)
+    cache.get("a")  # 'b' is now the least recently used
+    clock.advance(1)
+    cache.set("d", response(4))
+
+    assert cache.get("b") is None
+    assert all(cache.get(key) is not None for key in "acd")
+    assert cache.stats()["entries"] == 3
+
+
+def test_byte_bound_evicts_until_within_bounds(tmp_path, clock):
+    entry = size_of(response(0, padding=100))
+    cache = make_cache(tmp_path, clock, max_bytes=3 * entry)
+    for i in range(5):
+        cache.set(str(i), response(i, padding=100))
+        clock.advance(1)
+
+    stats = cache.stats()
+    assert stats["entries"] == 3
+    assert stats["bytes"] <= 3 * entry
+    assert [cache.get(str(i)) is not None for i in range(5)] == [False, False, True, True, True]
+
+
+def test_replacing_an_entry_keeps_the_totals(tmp_path, clock):
+    cache = make_cache(tmp_path, clock)
+    cache.set("a", response(0, padding=10))
+    cache.set("a", response(0, padding=500))
+    cache.set("b", response(1))
+    assert cache.stats()["entries"] == 2
+    assert cache.stats()["bytes"] == size_of(response(0, padding=500)) + size_of(response(1))
+
+    cache.clear()
+    assert cache.stats()["entries"] == 0
+    assert cache.stats()["bytes"] == 0
+
+
+def test_totals_are_loaded_from_an_existing_file(tmp_path, clock):
+    cache = make_cache(tmp_path, clock)
+    cache.set("a", response(0))
+    cache.set("b", response(1))
+
+    reopened = make_cache(tmp_path, clock)
+    assert reopened.stats()["entries"] == 2
+    assert reopened.stats()["bytes"] == size_of(response(0)) + size_of(response(1))
@@ -0,0 +1,157 @@
+import time
+
+import pytest
+
+import resilience
+from endpoint_pool import EndpointPool
+from extraction.metrics import METRICS
+from fake_endpoint import FakeEndpointError, constant, fake_endpoint_factory
+from resilience import CircuitBreaker, CircuitOpenError, LatencyBudgetExceeded, ResilientPredictor
+
+
+class FakeClock:
+    # stands for the `time` module of resilience, sleeping only moves the clock forward
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    perf_counter = monotonic
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def fake_pool(size=1, **kwargs):
+    # the endpoints are kept to count the predictions they made
+    endpoints = []
+    factory = fake_endpoint_factory(seed=0, **kwargs)
+
+    def connect():
+        endpoints.append(factory())
+        return endpoints[-1]
+
+    return EndpointPool(size=size, factory=connect), endpoints
+
+
+def predictions(endpoints):
+    return sum(endpoint.predictions for endpoint in endpoints)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(resilience, "time", clock)
+    return clock
+
+
+def test_breaker_opens_half_opens_and_closes(clock):
+    breaker = CircuitBreaker(failures=3, reset_timeout=10, clock=clock.monotonic)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == "closed" and breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+    clock.sleep(9.9)
+    assert breaker.state == "open"
+
+    clock.sleep(0.1)
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+    assert not breaker.allow()  # a single trial call
+
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow()
+
+
+def test_failed_trial_opens_the_breaker_again(clock):
+    breaker = CircuitBreaker(failures=1, reset_timeout=10, clock=clock.monotonic)
+    breaker.record_failure()
+    clock.sleep(10)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    clock.sleep(10)
+    assert breaker.state == "half_open"
+
+
+def test_open_breaker_refuses_calls_without_calling_the_endpoint(clock):
+    pool, endpoints = fake_pool(error_rate=1.0)
+    predictor = ResilientPredictor(
+        pool, budget=None, max_attempts=1, hedge=False, breaker=CircuitBreaker(failures=2, clock=clock.monotonic)
+    )
+    for _ in range(2):
+        with pytest.raises(FakeEndpointError):
+            predictor.predict_bytes(b"label")
+    with pytest.raises(CircuitOpenError):
+        predictor.predict_bytes(b"label")
+    assert predictions(endpoints) == 2
+
+
+def test_retries_back_off_within_the_cap(clock):
+    pool, endpoints = fake_pool(error_rate=1.0)
+    predictor = ResilientPredictor(
+        pool, budget=None, max_attempts=5, backoff_base=1, backoff_cap=3, hedge=False,
+        breaker=CircuitBreaker(failures=100), seed=0,
+    )
+    with pytest.raises(FakeEndpointError):
+        predictor.predict_bytes(b"label")
+
+    # one endpoint call per attempt, the pool does not retry on its own
+    assert predictions(endpoints) == 5
+    assert len(clock.sleeps) == 4
+    assert all(0 <= delay <= min(3, 2 ** attempt) for attempt, delay in enumerate(clock.sleeps))
+
+
+def test_backoff_stays_within_the_budget(clock):
+    pool, endpoints = fake_pool(error_rate=1.0)
+    predictor = ResilientPredictor(
+        pool, budget=5, max_attempts=100, backoff_base=1, backoff_cap=8, hedge=False,
+        breaker=CircuitBreaker(failures=1000), seed=0,
+    )
+    with pytest.raises(LatencyBudgetExceeded):
+        predictor.predict_bytes(b"label")
+
+    # a retry whose backoff would end past the deadline is not waited for
+    assert sum(clock.sleeps) < 5
+    assert predictions(endpoints) == len(clock.sleeps) + 1
+
+
+def test_hedge_is_skipped_without_a_free_endpoint():
+    skipped = METRICS.counters["hedges_skipped"]
+    pool, endpoints = fake_pool(size=1, predict_latency=constant(0.1))
+    predictor = ResilientPredictor(pool, budget=5, hedge=True, hedge_after=0.01)
+    try:
+        assert predictor.predict_bytes(b"label")["objects"]
+    finally:
+        predictor.close()
+    assert predictions(endpoints) == 1
+    assert METRICS.counters["hedges_skipped"] == skipped + 1
+
+
+def test_slow_attempt_is_hedged_with_a_free_endpoint():
+    hedged = METRICS.counters["hedged_requests"]
+    pool, endpoints = fake_pool(size=2, predict_latency=constant(0.1))
+    predictor = ResilientPredictor(pool, budget=5, hedge=True, hedge_after=0.01)
+    try:
+        assert predictor.predict_bytes(b"label")["objects"]
+    finally:
+        predictor.close()
+    assert METRICS.counters["hedged_requests"] == hedged + 1
+    assert len(endpoints) == 2
+
+
+def test_budget_exceeded_is_raised_on_time():
+    pool, _ = fake_pool(predict_latency=constant(1.0))
+    predictor = ResilientPredictor(pool, budget=0.2, hedge=False)
+    start = time.perf_counter()
+    try:
+        with pytest.raises(LatencyBudgetExceeded):
+            predictor.predict_bytes(b"label")
+    finally:
+        predictor.close()
+    assert 0.2 <= time.perf_counter() - start < 0.5
@@ -0,0 +1,152 @@
+import asyncio
+import json
+from contextlib import asynccontextmanager
+
+import pytest
+
+from endpoint_pool import EndpointPool
+from extraction.metrics import METRICS
+from fake_endpoint import FakeEndpointError, constant, fake_endpoint_factory, load_responses
+from server import ExtractionServer, ExtractionService, Overloaded
+
+RESPONSE = load_responses()[0]
+
+
+@asynccontextmanager
+async def serving(predict_latency=0.0, error_rate=0.0, **options):
+    # a started service on fake endpoints, with its HTTP front end on a free port
+    endpoints = []
+    factory = fake_endpoint_factory(predict_latency=constant(predict_latency), error_rate=error_rate, seed=0)
+
+    def connect():
+        endpoints.append(factory())
+        return endpoints[-1]
+
+    options = {"window": 0.05, "parse_workers": 1, "downscale": False, **options}
+    service = ExtractionService(EndpointPool(size=4, factory=connect), **options)
+    await service.start()
+    server = await asyncio.start_server(ExtractionServer(service).handle, "127.0.0.1", 0)
+    try:
+        yield service, server.sockets[0].getsockname()[1], endpoints
+    finally:
+        server.close()
+        await server.wait_closed()
+        await service.close()
+
+
+async def exchange(port, request):
+    # sends raw bytes and reads one answer, then whether the server closed the connection
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        writer.write(request)
+        await writer.drain()
+        status = int((await reader.readline()).split()[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        body = json.loads(await reader.readexactly(int(headers["content-length"])))
+        closed = await reader.read() == b""
+        return status, headers, body, closed
+    finally:
+        writer.close()
+
+
+def post(body, content_type="image/png", close=True):
+    return (
+        f"POST /extract HTTP/1.1\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+        f"{'Connection: close' if close else ''}\r\n\r\n"
+    ).encode("latin-1") + body
+
+
+def counter(name):
+    return METRICS.counters[name]
+
+
+def test_requests_within_the_window_are_batched():
+    async def main():
+        async with serving(window=0.05) as (service, _, _):
+            batches = counter("service_batches")
+            results = await asyncio.gather(*(service.extract(response=RESPONSE) for _ in range(5)))
+            assert counter("service_batches") == batches + 1
+            assert all(result == results[0] and result for result in results)
+
+    asyncio.run(main())
+
+
+def test_the_same_image_in_a_batch_is_predicted_once():
+    async def main():
+        async with serving() as (service, _, endpoints):
+            deduplicated = counter("service_deduplicated")
+            images = [b"label a"] * 4 + [b"label b"]
+            results = await asyncio.gather(*(service.extract(image_bytes=image) for image in images))
+            assert sum(endpoint.predictions for endpoint in endpoints) == 2
+            assert counter("service_deduplicated") == deduplicated + 3
+            assert results[0] == results[1] == results[2] == results[3]
+
+    asyncio.run(main())
+
+
+def test_a_failed_job_does_not_fail_its_batch():
+    async def main():
+        async with serving(error_rate=1.0) as (service, _, _):
+            batches = counter("service_batches")
+            results = await asyncio.gather(
+                service.extract(response=RESPONSE),
+                service.extract(response={"objects": [1, 2]}),
+                service.extract(image_bytes=b"label"),
+                return_exceptions=True,
+            )
+            assert counter("service_batches") == batches + 1
+            assert isinstance(results[0], dict) and results[0]
+            assert isinstance(results[1], ValueError)
+            assert isinstance(results[2], FakeEndpointError)
+
+    asyncio.run(main())
+
+
+def test_a_full_queue_is_refused_with_retry_after():
+    async def main():
+        async with serving(predict_latency=0.3, window=0, max_batch=1, max_batches=1, max_queue=1) as (service, port, _):
+            # one batch in flight, one taken by the batcher waiting for a slot, one in the queue
+            pending = []
+            for i in range(3):
+                pending.append(asyncio.create_task(service.extract(image_bytes=f"label {i}".encode())))
+                await asyncio.sleep(0.02)
+            with pytest.raises(Overloaded):
+                await service.extract(image_bytes=b"label 3")
+
+            status, headers, body, _ = await exchange(port, post(b"label 4"))
+            assert status == 503
+            assert headers["retry-after"] == "1"
+            assert "error" in body
+            # the queued requests are still answered
+            assert all(await asyncio.gather(*pending))
+
+    asyncio.run(main())
+
+
+@pytest.mark.parametrize(
+    "request_bytes",
+    [
+        b"GARBAGE\r\n\r\n",
+        b"POST /extract\r\n\r\n",
+        b"POST /extract HTTP/1.1\r\nContent-Length: ten\r\n\r\n",
+        b"POST /extract HTTP/1.1\r\nContent-Length: -1\r\n\r\n",
+    ],
+)
+def test_malformed_requests_get_400_and_the_connection_closed(request_bytes):
+    async def main():
+        async with serving() as (_, port, _):
+            status, _, body, closed = await exchange(port, request_bytes)
+            assert status == 400
+            assert "error" in body
+            assert closed
+            # the server keeps serving the other clients
+            status, _, body, _ = await exchange(port, post(json.dumps(RESPONSE).encode(), "application/json"))
+            assert status == 200 and body["nutrition"]
+
+    asyncio.run(main())
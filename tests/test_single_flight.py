@@ -0,0 +1,87 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from prediction_cache import PredictionCache, image_key
+from single_flight import SingleFlight
+
+CALLERS = 8
+
+
+class CountingPredict:
+    # waits until every other caller is waiting on it, so the misses really are concurrent
+    def __init__(self, flight, waiters, response=None, error=None):
+        self.flight = flight
+        self.waiters = waiters
+        self.response = response
+        self.error = error
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            self.calls += 1
+        deadline = time.monotonic() + 5
+        while self.flight.coalesced < self.waiters and time.monotonic() < deadline:
+            time.sleep(0.001)
+        if self.error is not None:
+            raise self.error
+        return self.response
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return PredictionCache(str(tmp_path / "predictions.sqlite3"))
+
+
+def test_concurrent_misses_call_predict_once(cache):
+    response = {"objects": [{"texts": [{"text": "Sodium"}]}]}
+    predict = CountingPredict(cache._in_flight, CALLERS - 1, response=response)
+    with ThreadPoolExecutor(CALLERS) as executor:
+        results = list(executor.map(lambda _: cache.get_or_predict(b"label", predict), range(CALLERS)))
+
+    assert predict.calls == 1
+    assert results == [response] * CALLERS
+    assert cache.stats()["coalesced"] == CALLERS - 1
+    assert cache._in_flight.in_flight() == 0
+
+
+def test_a_miss_finished_by_a_previous_leader_is_looked_up_again(cache, monkeypatch):
+    # the leader stored the response between this caller's miss and it taking the key
+    response = {"objects": []}
+    cache.set(image_key(b"label"), response)
+    monkeypatch.setattr(cache, "get", lambda key: None)
+    predict = CountingPredict(cache._in_flight, 0, response={"objects": [{}]})
+
+    assert cache.get_or_predict(b"label", predict) == response
+    assert predict.calls == 0
+
+
+def test_waiters_get_the_error_of_the_leader(cache):
+    predict = CountingPredict(cache._in_flight, CALLERS - 1, error=ConnectionError("endpoint down"))
+
+    def call(_):
+        try:
+            cache.get_or_predict(b"label", predict)
+        except ConnectionError as e:
+            return e
+
+    with ThreadPoolExecutor(CALLERS) as executor:
+        errors = list(executor.map(call, range(CALLERS)))
+
+    assert predict.calls == 1
+    assert all(error is predict.error for error in errors)
+    # nothing was cached and the key was released, the next miss calls predict again
+    predict.error = None
+    predict.response = {"objects": []}
+    assert cache.get_or_predict(b"label", predict) == {"objects": []}
+    assert predict.calls == 2
+
+
+def test_different_keys_are_not_coalesced():
+    flight = SingleFlight()
+    assert flight.do("a", lambda: 1) == 1
+    assert flight.do("b", lambda: 2) == 2
+    assert flight.coalesced == 0
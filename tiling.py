@@ -0,0 +1,304 @@
+"""
+Reads every nutrition label of a large image (a shelf, a pallet) by cutting it into
+overlapping tiles that are sent to EyePop in parallel, instead of one downscaled upload in
+which the small text is lost.
+
+The objects of every tile are moved back to the coordinates of the whole image, the text
+boxes found twice in the overlap between tiles are merged, and the objects are grouped into
+separate labels before each label is parsed on its own.
+
+Usage:
+    python tiling.py shelf.jpg --tile-size 1024 --overlap 128 --workers 4
+"""
+import argparse
+import io
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageOps
+from extraction import NUTRITIONS, THRESHOLD, get_nutrition_values
+from extraction.metrics import METRICS
+from preprocess import MIME_TYPES, UPLOAD_FORMAT, UPLOAD_QUALITY
+
+# variables
+TILE_SIZE = int(os.getenv("TILE_SIZE", 1024))  # width/height of a tile in pixels
+TILE_OVERLAP = int(os.getenv("TILE_OVERLAP", 128))  # should be taller than a line of text
+IOU_THRESHOLD = 0.5  # boxes overlapping more than this are the same text
+CONTAINMENT_THRESHOLD = 0.8  # a box this much inside another one is a piece of it cut by a tile edge
+# objects further apart than this, in heights of a line of text, belong to different labels
+LABEL_ROW_GAP = 4.0  # vertically, between the rows of a label and across its separator bars
+LABEL_COLUMN_GAP = 20.0  # horizontally, between a nutrition and its values
+GRID_CELL = 64  # pixels per cell of the grid used to find nearby boxes
+
+
+def tile_boxes(width, height, tile_size=TILE_SIZE, overlap=TILE_OVERLAP):
+    """
+    Gets the (left, top, right, bottom) boxes of the tiles covering the image, consecutive
+    tiles sharing `overlap` pixels so a line of text cut by one tile is whole in the next.
+
+    Args:
+        width (int): Width of the image.
+        height (int): Height of the image.
+        tile_size (int): Width/height of a tile, the last tiles of a row or column are shifted
+            back to end on the edge of the image rather than being smaller.
+        overlap (int): Pixels shared by two neighbouring tiles.
+
+    Returns:
+        list: The tile boxes, row by row.
+    """
+    if overlap >= tile_size:
+        raise ValueError("the overlap must be smaller than the tile size")
+
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        positions = list(range(0, length - tile_size, tile_size - overlap))
+        return positions + [length - tile_size]
+
+    return [
+        (left, top, min(left + tile_size, width), min(top + tile_size, height))
+        for top in starts(height)
+        for left in starts(width)
+    ]
+
+
+def offset_objects(objects, left, top):
+    """
+    Moves the objects of a tile to the coordinates of the whole image.
+    """
+    return [{**obj, "x": obj.get("x", 0) + left, "y": obj.get("y", 0) + top} for obj in objects]
+
+
+def area(obj):
+    """
+    Gets the area of an object's box.
+    """
+    return obj.get("width", 0) * obj.get("height", 0)
+
+
+def iou(a, b):
+    """
+    Gets the intersection over union of two objects' boxes, and the intersection over the area
+    of the smaller box, which tells when a box cut by a tile edge is part of a whole one.
+
+    Returns:
+        tuple: (intersection over union, intersection over the smaller area).
+    """
+    width = min(a["x"] + a.get("width", 0), b["x"] + b.get("width", 0)) - max(a["x"], b["x"])
+    height = min(a["y"] + a.get("height", 0), b["y"] + b.get("height", 0)) - max(a["y"], b["y"])
+    if width <= 0 or height <= 0:
+        return 0.0, 0.0
+    intersection = width * height
+    return intersection / (area(a) + area(b) - intersection), intersection / min(area(a), area(b))
+
+
+def grid_cells(obj, cell=GRID_CELL, margin_x=0, margin_y=0):
+    """
+    Gets the (column, row) cells of a grid of `cell` pixels covered by the box of an object,
+    grown by `margin_x` pixels on the left and right and `margin_y` pixels above and below.
+    """
+    left = int((obj["x"] - margin_x) // cell)
+    right = int((obj["x"] + obj.get("width", 0) + margin_x) // cell)
+    top = int((obj["y"] - margin_y) // cell)
+    bottom = int((obj["y"] + obj.get("height", 0) + margin_y) // cell)
+    return [(column, row) for column in range(left, right + 1) for row in range(top, bottom + 1)]
+
+
+def merge_objects(objects, iou_threshold=IOU_THRESHOLD, containment_threshold=CONTAINMENT_THRESHOLD):
+    """
+    Removes the duplicate text boxes found by two overlapping tiles. Of two boxes overlapping by
+    more than `iou_threshold` the most confident one is kept, of a box mostly inside another one
+    (the same text cut by a tile edge) the larger one is kept.
+
+    Args:
+        objects (list): Objects of every tile, in the coordinates of the whole image.
+        iou_threshold (float): Minimum intersection over union of duplicate boxes.
+        containment_threshold (float): Minimum fraction of a box inside another for it to be a piece of it.
+
+    Returns:
+        list: The objects without duplicates, in their original order.
+    """
+    order = sorted(range(len(objects)), key=lambda pos: objects[pos].get("confidence", 0), reverse=True)
+    kept = {}  # position -> object, of the boxes kept so far
+    grid = {}  # cell -> positions of the kept boxes covering it
+    for pos in order:
+        obj = objects[pos]
+        cells = grid_cells(obj)
+        for other in {other for cell in cells for other in grid.get(cell, ())}:
+            overlap, containment = iou(obj, kept[other])
+            if overlap >= iou_threshold:
+                break  # the same box, the kept one is more confident
+            if containment >= containment_threshold:
+                if area(obj) > area(kept[other]):
+                    # the kept box is a piece of this one, keep the whole text in its place
+                    kept[other] = obj
+                    for cell in cells:
+                        grid.setdefault(cell, []).append(other)
+                break
+        else:
+            kept[pos] = obj
+            for cell in cells:
+                grid.setdefault(cell, []).append(pos)
+    return [kept[pos] for pos in sorted(kept)]
+
+
+def group_labels(objects, row_gap=LABEL_ROW_GAP, column_gap=LABEL_COLUMN_GAP):
+    """
+    Groups the objects into separate labels: two objects are on the same label when the empty
+    space between their boxes is small, labels being separated by wider empty space. The gaps
+    are relative to the median height of the text, so they do not depend on the resolution.
+
+    Args:
+        objects (list): Objects of the whole image.
+        row_gap (float): Maximum vertical gap between neighbouring objects of a label, in line heights.
+        column_gap (float): Maximum horizontal gap between neighbouring objects of a label, in line heights.
+
+    Returns:
+        list: One list of objects per label, ordered top to bottom then left to right.
+    """
+    heights = sorted(obj["height"] for obj in objects if obj.get("height", 0) > 0)
+    line_height = heights[len(heights) // 2] if heights else 10
+    gap_x, gap_y = column_gap * line_height, row_gap * line_height
+    parent = list(range(len(objects)))
+
+    def find(pos):
+        while parent[pos] != pos:
+            parent[pos] = parent[parent[pos]]
+            pos = parent[pos]
+        return pos
+
+    def near(a, b):
+        return (
+            a["x"] - gap_x <= b["x"] + b.get("width", 0)
+            and b["x"] - gap_x <= a["x"] + a.get("width", 0)
+            and a["y"] - gap_y <= b["y"] + b.get("height", 0)
+            and b["y"] - gap_y <= a["y"] + a.get("height", 0)
+        )
+
+    # only the objects sharing a cell of the grown boxes can be near each other
+    grid = {}
+    for pos, obj in enumerate(objects):
+        for cell in grid_cells(obj, margin_x=gap_x / 2, margin_y=gap_y / 2):
+            for other in grid.get(cell, ()):
+                if find(other) != find(pos) and near(obj, objects[other]):
+                    parent[find(other)] = find(pos)
+            grid.setdefault(cell, []).append(pos)
+
+    labels = {}
+    for pos, obj in enumerate(objects):
+        labels.setdefault(find(pos), []).append(obj)
+    return sorted(labels.values(), key=lambda label: (min(obj["y"] for obj in label), min(obj["x"] for obj in label)))
+
+
+def predict_tiled(predict_bytes, image_bytes, tile_size=TILE_SIZE, overlap=TILE_OVERLAP, workers=4, image_format=UPLOAD_FORMAT, quality=UPLOAD_QUALITY):
+    """
+    Gets the prediction of a large image tile by tile, with up to `workers` tiles in flight.
+
+    Args:
+        predict_bytes (callable): Called with the bytes of a tile and their mime type, returns the
+            EyePop response, e.g. `EndpointPool.predict_bytes`.
+        image_bytes (bytes): The raw bytes of the whole image.
+        tile_size (int): Width/height of a tile.
+        overlap (int): Pixels shared by two neighbouring tiles.
+        workers (int): Maximum number of tiles being uploaded at once.
+        image_format (str): Format the tiles are encoded to, 'JPEG' or 'WEBP'.
+        quality (int): Encoder quality from 1 to 100.
+
+    Returns:
+        dict: A response for the whole image, with the objects of every tile in its coordinates
+        and the duplicates from the overlaps merged. Object ids are renumbered, as the ids of
+        different tiles collide.
+    """
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(image_bytes)))
+    if image_format.upper() == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")  # JPEG has no alpha channel
+    boxes = tile_boxes(image.size[0], image.size[1], tile_size, overlap)
+
+    def predict_tile(box):
+        with METRICS.timer("tile_encode"):
+            buffer = io.BytesIO()
+            image.crop(box).save(buffer, format=image_format.upper(), quality=quality)
+        response = predict_bytes(buffer.getvalue(), MIME_TYPES[image_format.upper()]) or {}
+        return offset_objects(response.get("objects", []), box[0], box[1])
+
+    # the image is decoded once, the tiles are cropped and encoded by the upload threads
+    image.load()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        objects = [obj for tile in executor.map(predict_tile, boxes) for obj in tile]
+
+    with METRICS.timer("tile_merge"):
+        merged = merge_objects(objects)
+    METRICS.observe("tiles", len(boxes))
+    METRICS.observe("tile_duplicates", len(objects) - len(merged))
+    return {
+        "source_width": image.size[0],
+        "source_height": image.size[1],
+        "objects": [{**obj, "id": i} for i, obj in enumerate(merged)],
+    }
+
+
+def extract_labels(
+    response,
+    nutritions=NUTRITIONS,
+    threshold=THRESHOLD,
+    confidence_threshold=0.5,
+    row_gap=LABEL_ROW_GAP,
+    column_gap=LABEL_COLUMN_GAP,
+):
+    """
+    Splits the response of an image holding several labels into one response per label and
+    extracts the nutrition of each, so rows of neighbouring labels are never mixed.
+
+    Args:
+        response (dict): The response for the whole image, e.g. from `predict_tiled`.
+        nutritions (list): Keywords representing the nutrition to look for.
+        threshold (int or float): Threshold for proximity in 'y' values.
+        confidence_threshold (float): Minimum confidence level for valid objects.
+        row_gap (float): Maximum vertical gap between neighbouring objects of a label, in line heights.
+        column_gap (float): Maximum horizontal gap between neighbouring objects of a label, in line heights.
+
+    Returns:
+        list: One {'box', 'nutrition'} dictionary per label with nutrition, 'box' being its
+        (left, top, right, bottom) in the image.
+    """
+    labels = []
+    for objects in group_labels(response.get("objects", []), row_gap, column_gap):
+        nutrition = get_nutrition_values({"objects": objects}, nutritions, threshold, confidence_threshold)
+        if not nutrition:
+            continue  # e.g. a price tag or a brand name
+        box = (
+            min(obj["x"] for obj in objects),
+            min(obj["y"] for obj in objects),
+            max(obj["x"] + obj.get("width", 0) for obj in objects),
+            max(obj["y"] + obj.get("height", 0) for obj in objects),
+        )
+        labels.append({"box": box, "nutrition": nutrition})
+    return labels
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from endpoint_pool import EndpointPool
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("image", help="path of the image")
+    parser.add_argument("--tile-size", type=int, default=TILE_SIZE, help="width/height of a tile in pixels")
+    parser.add_argument("--overlap", type=int, default=TILE_OVERLAP, help="pixels shared by neighbouring tiles")
+    parser.add_argument("--workers", type=int, default=4, help="maximum number of tiles in flight")
+    parser.add_argument("--row-gap", type=float, default=LABEL_ROW_GAP, help="line heights between the rows of a label")
+    parser.add_argument("--column-gap", type=float, default=LABEL_COLUMN_GAP, help="line heights between the columns of a label")
+    parser.add_argument("--confidence", type=float, default=0.5, help="confidence threshold")
+    args = parser.parse_args()
+    load_dotenv()
+
+    with open(os.path.expanduser(args.image), "rb") as f:
+        image_bytes = f.read()
+    pool = EndpointPool(size=args.workers)
+    response = predict_tiled(pool.predict_bytes, image_bytes, args.tile_size, args.overlap, args.workers)
+    pool.close()
+    labels = extract_labels(
+        response, confidence_threshold=args.confidence, row_gap=args.row_gap, column_gap=args.column_gap
+    )
+    print(f"found {len(labels)} labels in {len(response['objects'])} objects")
+    for label in labels:
+        print(json.dumps(label))
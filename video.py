@@ -0,0 +1,204 @@
+# pip install opencv-python (on top of requirements.txt) to read video files
+"""
+Extracts one nutrition label from a video by sampling frames, skipping the frames that look
+like one already sent to EyePop, and merging the per-frame results into a consensus label.
+
+Usage:
+    python video.py clip.mp4 --every 0.5 --max-distance 6
+"""
+import argparse
+import io
+import os
+from collections import Counter
+from PIL import Image
+from extraction import NUTRITIONS, THRESHOLD, get_nutrition_values
+
+# variables
+SAMPLE_EVERY = 1.0  # seconds between sampled frames
+MAX_HASH_DISTANCE = 6  # frames whose hash differ by at most this many bits are duplicates
+SEEK_MIN_STEP = 30  # frames between two samples from which seeking is cheaper than decoding them all
+
+
+def iter_frames(filepath, sample_every=SAMPLE_EVERY):
+    """
+    Lazily reads the frames of a video, one every `sample_every` seconds. When the samples are
+    at least `SEEK_MIN_STEP` frames apart the video seeks to each of them, which only decodes
+    from the keyframe before it; otherwise every frame is decoded and only the sampled ones are
+    converted to images.
+
+    Args:
+        filepath (str): Path of the video.
+        sample_every (float): Seconds between two sampled frames.
+
+    Yields:
+        tuple: The timestamp in seconds and the frame as a PIL image.
+    """
+    try:
+        import cv2
+    except ImportError as e:
+        raise ImportError("Reading videos requires opencv, install it with `pip install opencv-python`") from e
+
+    capture = cv2.VideoCapture(filepath)
+    if not capture.isOpened():
+        raise ValueError(f"Could not open video {filepath}")
+    fps = capture.get(cv2.CAP_PROP_FPS) or 30
+    step = max(1, round(fps * sample_every))
+    frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    try:
+        if step >= SEEK_MIN_STEP and frame_count > 0:
+            for index in range(0, frame_count, step):
+                capture.set(cv2.CAP_PROP_POS_FRAMES, index)
+                ok, frame = capture.read()
+                if not ok:
+                    break  # the frame count of some containers is only an estimate
+                yield index / fps, Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+            return
+
+        index = 0
+        while capture.grab():  # grab decodes the frame, retrieve only converts it
+            if index % step == 0:
+                ok, frame = capture.retrieve()
+                if ok:
+                    yield index / fps, Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+            index += 1
+    finally:
+        capture.release()
+
+
+def dhash(image, hash_size=8):
+    """
+    Computes the difference hash of an image: a perceptual hash where similar looking images
+    get hashes that differ in few bits.
+
+    Args:
+        image (PIL.Image): The image to hash.
+        hash_size (int): The hash has hash_size * hash_size bits.
+
+    Returns:
+        int: The hash of the image.
+    """
+    pixels = list(image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR).getdata())
+    bits = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            bits = (bits << 1) | (left > pixels[row * (hash_size + 1) + col + 1])
+    return bits
+
+
+def hamming_distance(a, b):
+    """
+    Counts the bits that differ between two hashes.
+    """
+    return bin(a ^ b).count("1")
+
+
+def distinct_frames(frames, max_distance=MAX_HASH_DISTANCE):
+    """
+    Filters out the frames that are near duplicates of a frame already let through.
+
+    Args:
+        frames (iterable): (timestamp, PIL image) tuples, e.g. from `iter_frames`.
+        max_distance (int): Frames whose hash is within this many bits of a kept frame are dropped.
+
+    Yields:
+        tuple: The (timestamp, PIL image) of the distinct frames.
+    """
+    kept_hashes = []
+    for timestamp, image in frames:
+        frame_hash = dhash(image)
+        if any(hamming_distance(frame_hash, kept) <= max_distance for kept in kept_hashes):
+            continue
+        kept_hashes.append(frame_hash)
+        yield timestamp, image
+
+
+def merge_nutrition(results):
+    """
+    Merges the nutrition extracted from several frames into one consensus label, keeping the
+    most common value of each nutrition (the earliest seen one on a tie).
+
+    Args:
+        results (list): Dictionaries from `get_nutrition_values`, one per frame.
+
+    Returns:
+        dict: The consensus nutritional information.
+    """
+    votes = {}
+    for result in results:
+        for nutrition, value in result.items():
+            votes.setdefault(nutrition, Counter())[value] += 1
+    # Counter.most_common keeps insertion order between equal counts
+    return {nutrition: counter.most_common(1)[0][0] for nutrition, counter in votes.items()}
+
+
+def encode_frame(image, quality=85):
+    """
+    Encodes a frame as JPEG bytes for upload.
+    """
+    buffer = io.BytesIO()
+    image.convert("RGB").save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def extract_video_label(
+    frames,
+    predict_bytes,
+    nutritions=NUTRITIONS,
+    threshold=THRESHOLD,
+    confidence_threshold=0.5,
+    max_distance=MAX_HASH_DISTANCE,
+):
+    """
+    Sends the distinct frames of a video to EyePop and merges their nutrition into one label.
+
+    Args:
+        frames (iterable): (timestamp, PIL image) tuples, e.g. from `iter_frames`.
+        predict_bytes (callable): Called with the bytes of a frame and their mime type, returns the
+            EyePop response, e.g. `EndpointPool.predict_bytes`.
+        nutritions (list): Keywords representing the nutrition to look for.
+        threshold (int or float): Threshold for proximity in 'y' values.
+        confidence_threshold (float): Minimum confidence level for valid objects.
+        max_distance (int): Maximum hash distance for a frame to count as a duplicate.
+
+    Returns:
+        dict: The consensus 'nutrition', the number of frames 'sampled' and the number 'sent' to EyePop.
+    """
+    sampled = 0
+
+    def count(frames):
+        nonlocal sampled
+        for frame in frames:
+            sampled += 1
+            yield frame
+
+    results = []
+    for _, image in distinct_frames(count(frames), max_distance):
+        response = predict_bytes(encode_frame(image), "image/jpeg")
+        results.append(get_nutrition_values(response, nutritions, threshold, confidence_threshold))
+
+    return {"nutrition": merge_nutrition(results), "sampled": sampled, "sent": len(results)}
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from endpoint_pool import EndpointPool
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("video", help="path of the video")
+    parser.add_argument("--every", type=float, default=SAMPLE_EVERY, help="seconds between sampled frames")
+    parser.add_argument("--max-distance", type=int, default=MAX_HASH_DISTANCE, help="hash distance of duplicate frames")
+    parser.add_argument("--confidence", type=float, default=0.5, help="confidence threshold")
+    args = parser.parse_args()
+    load_dotenv()
+
+    pool = EndpointPool(size=1)
+    result = extract_video_label(
+        iter_frames(os.path.expanduser(args.video), args.every),
+        pool.predict_bytes,
+        confidence_threshold=args.confidence,
+        max_distance=args.max_distance,
+    )
+    pool.close()
+    print(f"sent {result['sent']} of {result['sampled']} sampled frames")
+    print(result["nutrition"])